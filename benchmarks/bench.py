@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+
+"""
+Offline benchmarks for every stage of the fetch pipeline.
+
+Runs against synthetic RDB documents, so no network is needed:
+
+    python benchmarks/bench.py --sites 200 --days 7
+    python benchmarks/bench.py --compare benchmarks/results/0.1.0.json
+
+Each stage is timed on its own and the whole pipeline end to end.
+Results are written as JSON so runs from different releases can be
+compared with `--compare`.
+"""
+
+from typing import Callable, TypedDict
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from riverdata import fetch, parallel, storage
+from riverdata.math import get_prediction_info_fixed, get_prediction_infos_fixed
+from riverdata.registry import Registry
+from riverdata.types import Stats
+
+import synth
+
+
+class StageResult(TypedDict):
+    seconds_min: float
+    seconds_median: float
+    rows_per_s: float
+    sites_per_s: float
+    peak_bytes: int
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+PYPROJECT_FILEPATH = os.path.join(os.path.dirname(BENCH_DIR), "pyproject.toml")
+
+REGRESSION_THRESHOLD = 0.10
+
+
+def _get_version():
+    """
+    Returns the version in the checkout's pyproject.toml, which is the
+    code being benchmarked whether or not the package is installed.
+    Python 3.10 has no tomllib, so the `[project]` table is matched
+    line by line.
+    """
+    in_project = False
+    with open(PYPROJECT_FILEPATH, "r", encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if line.startswith("["):
+                in_project = line == "[project]"
+                continue
+            match = re.fullmatch(r'version\s*=\s*"([^"]+)"', line)
+            if in_project and match is not None:
+                return match.group(1)
+    raise ValueError("No project version in %s" % PYPROJECT_FILEPATH)
+
+
+def _time(func: Callable[[], object], repeat: int):
+    ret: list[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        ret.append(time.perf_counter() - start)
+    return ret
+
+
+def _measure_peak(func: Callable[[], object]):
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def _run_stage(func: Callable[[], object], rows: int, sites: int, repeat: int):
+    times = _time(func, repeat)
+    best = min(times)
+    ret: StageResult = {
+        "seconds_min": best,
+        "seconds_median": statistics.median(times),
+        "rows_per_s": rows / best if best > 0 else 0.0,
+        "sites_per_s": sites / best if best > 0 else 0.0,
+        "peak_bytes": _measure_peak(func),
+    }
+    return ret
+
+
+def run(
+    num_sites: int,
+    days: int,
+    missing: float,
+    provisional: float,
+    fixed_tz: str | None,
+    repeat: int,
+    workers: int | None = None,
+):
+    sites = synth.make_sites(num_sites)
+    registry = Registry(sites, synth.make_parks(sites))
+    docs = synth.make_site_docs(
+        sites,
+        days,
+        missing=missing,
+        provisional=provisional,
+        fixed_tz=fixed_tz,
+    )
+    curr_dt = fetch.get_curr_date()
+    begin_date = fetch.get_back_date(curr_dt, days)
+    url = fetch.URL
+
+    parsed = dict(
+        map(
+            lambda x: (
+                x["site_no"],
+                list(fetch.parse_rdb(fetch.iter_lines(docs[x["site_no"]]))),
+            ),
+            sites,
+        )
+    )
+    batches = dict(
+        map(
+            lambda x: (x["site_no"], fetch.normalize_batch(x, parsed[x["site_no"]])),
+            sites,
+        )
+    )
+    stats: Stats = {}
+    for site in sites:
+        stat = fetch.build_stats(
+            site, url, batches[site["site_no"]], curr_dt, begin_date
+        )
+        if stat is not None:
+            stats[site["site_no"]] = stat
+    windows = list(
+        map(
+            lambda x: fetch.get_recent_vals(batches[x["site_no"]], "discharge"),
+            sites,
+        )
+    )
+    rows = sum(map(len, parsed.values()))
+
+    tmpdir = tempfile.mkdtemp(prefix="riverdata-bench-")
+    stats_filepath = os.path.join(tmpdir, "stats.json")
+    storage.write_sites(stats_filepath, stats)
+
+    def _parse():
+        for site in sites:
+            for _ in fetch.parse_rdb(fetch.iter_lines(docs[site["site_no"]])):
+                pass
+
+    def _normalize():
+        for site in sites:
+            fetch.normalize_batch(site, parsed[site["site_no"]])
+
+    def _stats():
+        for site in sites:
+            fetch.build_stats(site, url, batches[site["site_no"]], curr_dt, begin_date)
+
+    def _prediction():
+        for window in windows:
+            if len(window) > 0:
+                get_prediction_info_fixed(window, fetch.PREDICTION_COUNT)
+
+    def _prediction_many():
+        get_prediction_infos_fixed(windows, fetch.PREDICTION_COUNT)
+
+    def _write():
+        storage.write_sites(stats_filepath, stats)
+
+    def _read():
+        storage.read_parks_stats(stats_filepath, registry=registry)
+
+    def _parallel():
+        parallel.build_stats_parallel(
+            list(docs.values()), sites, begin_date, curr_dt, workers=workers
+        )
+
+    def _end_to_end():
+        out: Stats = {}
+        for site in sites:
+            stat = fetch.build_for_site(
+                site, docs[site["site_no"]], url, curr_dt, begin_date
+            )
+            if stat is not None:
+                out[site["site_no"]] = stat
+        storage.write_sites(stats_filepath, out)
+        storage.read_parks_stats(stats_filepath, registry=registry)
+
+    stages: dict[str, Callable[[], object]] = {
+        "parse": _parse,
+        "normalize": _normalize,
+        "build_stats": _stats,
+        "prediction": _prediction,
+        "prediction_many": _prediction_many,
+        "write_sites": _write,
+        "read_parks_stats": _read,
+        "end_to_end": _end_to_end,
+        "build_parallel": _parallel,
+    }
+    results: dict[str, StageResult] = {}
+    for name, func in stages.items():
+        results[name] = _run_stage(func, rows, num_sites, repeat)
+    os.unlink(stats_filepath)
+    os.rmdir(tmpdir)
+    return {
+        "meta": {
+            "version": _get_version(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "params": {
+                "sites": num_sites,
+                "days": days,
+                "missing": missing,
+                "provisional": provisional,
+                "fixed_tz": fixed_tz,
+                "repeat": repeat,
+                "workers": workers or os.cpu_count(),
+                "cpus": os.cpu_count(),
+                "rows": rows,
+            },
+        },
+        "stages": results,
+    }
+
+
+def _print_results(results: dict):
+    params = results["meta"]["params"]
+    print("%(sites)d sites, %(days)d days, %(rows)d rows, best of %(repeat)d" % params)
+    print(
+        "%-18s %12s %14s %12s %12s"
+        % ("stage", "seconds", "rows/s", "sites/s", "peak MiB")
+    )
+    for name, res in results["stages"].items():
+        print(
+            "%-18s %12.4f %14.0f %12.1f %12.2f"
+            % (
+                name,
+                res["seconds_min"],
+                res["rows_per_s"],
+                res["sites_per_s"],
+                res["peak_bytes"] / (1024 * 1024),
+            )
+        )
+
+
+def compare(old: dict, new: dict, threshold: float):
+    """
+    Prints the time ratio of every stage against an earlier run and
+    returns the names of stages that got slower by more than
+    `threshold`.
+    """
+    ret: list[str] = []
+    print("%-18s %12s %12s %8s" % ("stage", "old s", "new s", "ratio"))
+    for name, res in new["stages"].items():
+        if name not in old["stages"]:
+            continue
+        old_s = old["stages"][name]["seconds_min"]
+        new_s = res["seconds_min"]
+        ratio = new_s / old_s if old_s > 0 else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            ret.append(name)
+        print("%-18s %12.4f %12.4f %8.2f%s" % (name, old_s, new_s, ratio, flag))
+    return ret
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--sites", type=int, default=100)
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--missing", type=float, default=0.02)
+    parser.add_argument("--provisional", type=float, default=0.8)
+    parser.add_argument("--fixed-tz", default=None)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--workers", type=int, default=None, help="build_parallel processes"
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="results file, defaults to benchmarks/results/<version>.json",
+    )
+    parser.add_argument("--compare", default=None, help="earlier results file")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    results = run(
+        args.sites,
+        args.days,
+        args.missing,
+        args.provisional,
+        args.fixed_tz,
+        args.repeat,
+        args.workers,
+    )
+    _print_results(results)
+    output = (
+        os.path.join(RESULTS_DIR, results["meta"]["version"] + ".json")
+        if args.output is None
+        else args.output
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as fh:
+        json.dump(results, fh, indent=2)
+    print("Saved %s" % output)
+    if args.compare is None:
+        return 0
+    with open(args.compare, "r", encoding="utf-8") as fh:
+        old = json.load(fh)
+    regressions = compare(old, results, args.threshold)
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+"""
+Synthetic NWIS RDB documents for offline benchmarks.
+"""
+
+import datetime
+import math
+import random
+import zoneinfo
+
+from riverdata.types import Site, Park
+
+TIMEZONES = [
+    ("America/Denver", "MST", "MDT", "CO"),
+    ("America/Chicago", "CST", "CDT", "TX"),
+    ("America/New_York", "EST", "EDT", "NY"),
+    ("America/Los_Angeles", "PST", "PDT", "CA"),
+    ("America/Boise", "MST", "MDT", "ID"),
+]
+
+PROVISIONAL_CODES = ["P", "P:e", "A", "A:e"]
+
+INTERVAL = datetime.timedelta(minutes=15)
+
+
+def make_sites(count: int, seed: int = 0):
+    rnd = random.Random(seed)
+    ret: list[Site] = []
+    for i in range(count):
+        tzname, _, _, region = TIMEZONES[i % len(TIMEZONES)]
+        ret.append(
+            {
+                "site_no": "%08d" % (9000000 + i),
+                "name_full": "SYNTHETIC RIVER %d NEAR TESTVILLE %s" % (i, region),
+                "name_short": "Synth R %d" % i,
+                "region": region,
+                "timezone": tzname,
+                "feature_discharge": True,
+                "feature_temperature": rnd.random() < 0.5,
+            }
+        )
+    return ret
+
+
+def make_parks(sites: list[Site]):
+    ret: list[Park] = []
+    for i in range(0, len(sites), 2):
+        other = sites[min(i + 1, len(sites) - 1)]
+        ret.append(
+            {
+                "name": "Synthetic Park %d" % i,
+                "region": sites[i]["region"],
+                "timezone": sites[i]["timezone"],
+                "site_no_discharge": sites[i]["site_no"],
+                "site_no_temperature": other["site_no"],
+            }
+        )
+    return ret
+
+
+def _get_tz_code(site: Site, utc_dt: datetime.datetime):
+    for tzname, std, dst, _ in TIMEZONES:
+        if tzname == site["timezone"]:
+            local = utc_dt.astimezone(zoneinfo.ZoneInfo(tzname))
+            return (local, dst if local.dst() else std)
+    return (utc_dt, "UTC")
+
+
+def _make_table(
+    site: Site,
+    rnd: random.Random,
+    end: datetime.datetime,
+    days: int,
+    missing: float,
+    provisional: float,
+    fixed_tz: str | None,
+):
+    count = days * 96
+    base = rnd.uniform(50, 5000)
+    lines = [
+        "#",
+        "# Data provided for site %s" % site["site_no"],
+        "#            TS   parameter     Description",
+        "#         %06d       00060     Discharge, cubic feet per second" % 1,
+        "#         %06d       00010     Temperature, water, degrees Celsius" % 2,
+        "#",
+        "agency_cd\tsite_no\tdatetime\ttz_cd\t%06d_00060\t%06d_00060_cd"
+        "\t%06d_00010\t%06d_00010_cd" % (1, 1, 2, 2),
+        "5s\t15s\t20d\t6s\t14n\t10s\t14n\t10s",
+    ]
+    start = end - INTERVAL * count
+    for i in range(count):
+        utc_dt = start + INTERVAL * (i + 1)
+        if fixed_tz is None:
+            local, code = _get_tz_code(site, utc_dt)
+        else:
+            local, code = (utc_dt, fixed_tz)
+        phase = 2 * math.pi * i / 96
+        discharge = base * (1 + 0.2 * math.sin(phase)) + rnd.gauss(0, base * 0.01)
+        temperature = 10 + 5 * math.sin(phase) + rnd.gauss(0, 0.2)
+        flag = (
+            rnd.choice(PROVISIONAL_CODES[:2])
+            if rnd.random() < provisional
+            else rnd.choice(PROVISIONAL_CODES[2:])
+        )
+        lines.append(
+            "\t".join(
+                [
+                    "USGS",
+                    site["site_no"],
+                    local.strftime("%Y-%m-%d %H:%M"),
+                    code,
+                    "" if rnd.random() < missing else "%.0f" % discharge,
+                    flag,
+                    "" if rnd.random() < missing else "%.1f" % temperature,
+                    flag,
+                ]
+            )
+        )
+    return lines
+
+
+def make_rdb(
+    sites: list[Site],
+    days: int = 1,
+    missing: float = 0.02,
+    provisional: float = 0.8,
+    fixed_tz: str | None = None,
+    end: datetime.datetime | None = None,
+    seed: int = 0,
+):
+    """
+    Builds one RDB document holding a table per site, like a multi-site
+    NWIS `uv` response, with 15 minute readings over `days` days.
+
+    `missing` is the share of blank values, `provisional` the share of
+    provisional flags, and `fixed_tz` forces one tz code on every row
+    instead of the site's standard/daylight codes.
+    """
+    rnd = random.Random(seed)
+    end = (
+        datetime.datetime(2026, 6, 1, tzinfo=datetime.timezone.utc)
+        if end is None
+        else end
+    )
+    lines = [
+        "# ---------------------------------- WARNING ----------------------------",
+        "# Synthetic data generated for benchmarks.",
+    ]
+    for site in sites:
+        lines.extend(_make_table(site, rnd, end, days, missing, provisional, fixed_tz))
+    return "\n".join(lines) + "\n"
+
+
+def make_site_docs(sites: list[Site], days: int = 1, **kwargs):
+    """
+    Builds one single-site RDB document per site.
+    """
+    seed = kwargs.pop("seed", 0)
+    ret: dict[str, str] = {}
+    for i, site in enumerate(sites):
+        ret[site["site_no"]] = make_rdb([site], days, seed=seed + i, **kwargs)
+    return ret
@@ -0,0 +1,7 @@
+#!/usr/bin/env python3
+
+import sys
+
+from riverdata.cli import main
+
+sys.exit(main())
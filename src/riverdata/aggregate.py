@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+from typing import TypedDict
+from decimal import Decimal
+import datetime
+
+import numpy as np
+
+from riverdata import rowbatch
+from riverdata.rowbatch import RowBatch
+
+
+class ParamAggregate(TypedDict):
+    """
+    Indexes into the batch for one parameter over one window, or -1 when
+    the window has no value for the parameter.
+    """
+
+    count: int
+    recent_index: int
+    high_index: int
+    low_index: int
+
+
+class ParamSummary(TypedDict):
+    count: int
+    recent_value: Decimal | None
+    recent_datetime: datetime.datetime | None
+    high_value: Decimal | None
+    high_datetime: datetime.datetime | None
+    low_value: Decimal | None
+    low_datetime: datetime.datetime | None
+
+
+Windows = dict[str, datetime.timedelta | None]
+
+Aggregates = dict[str, dict[str, ParamAggregate]]
+
+WINDOW_ALL = "all"
+
+INT_MIN = int(np.iinfo(np.int64).min)
+
+INT_MAX = int(np.iinfo(np.int64).max)
+
+DEFAULT_WINDOWS: Windows = {
+    "24h": datetime.timedelta(hours=24),
+    "7d": datetime.timedelta(days=7),
+    "30d": datetime.timedelta(days=30),
+}
+
+
+def _get_window_sizes(times: np.ndarray, windows: Windows, end: np.datetime64):
+    """
+    Batches are newest first, so every window is a prefix of the batch.
+    Returns the prefix length of each window.
+    """
+    secs = times.astype("datetime64[s]").astype(np.int64)
+    end_secs = int(end.astype("datetime64[s]").astype(np.int64))
+    ret: dict[str, int] = {}
+    for name, span in windows.items():
+        if span is None:
+            ret[name] = len(secs)
+            continue
+        cutoff = end_secs - int(span.total_seconds())
+        ret[name] = int(np.searchsorted(-secs, -cutoff, side="right"))
+    return ret
+
+
+def _get_prefix_arg(vals: np.ndarray, valid: np.ndarray, fill: int, ufunc: np.ufunc):
+    """
+    Computes, in one scan, the index of the first extreme value of every
+    prefix of each row of `vals`. `ufunc` is np.maximum or np.minimum and
+    `fill` the value that can never win, used for missing readings.
+    """
+    filled = np.where(valid, vals, fill)
+    running = ufunc.accumulate(filled, axis=1)
+    prev = np.concatenate([np.full((vals.shape[0], 1), fill), running[:, :-1]], axis=1)
+    better = (filled > prev) if ufunc is np.maximum else (filled < prev)
+    idxs = np.where(better, np.arange(vals.shape[1]), 0)
+    return np.maximum.accumulate(idxs, axis=1)
+
+
+def aggregate(
+    batch: RowBatch,
+    windows: Windows | None = None,
+    end: np.datetime64 | None = None,
+    params: tuple[str, ...] = rowbatch.PARAMS,
+):
+    """
+    Computes count, recent, high and low for every parameter and every
+    window in a single pass over the batch.
+
+    Windows reach back by their span from `end`, which defaults to the
+    newest reading; a span of None covers the whole batch. Ties resolve
+    to the newest reading.
+    """
+    windows = {WINDOW_ALL: None} if windows is None else windows
+    size = rowbatch.get_size(batch)
+    ret: Aggregates = dict(map(lambda x: (x, {}), windows))
+    if size == 0:
+        for name in windows:
+            for param in params:
+                ret[name][param] = {
+                    "count": 0,
+                    "recent_index": -1,
+                    "high_index": -1,
+                    "low_index": -1,
+                }
+        return ret
+    end = batch["datetime"][0] if end is None else end
+    sizes = _get_window_sizes(batch["datetime"], windows, end)
+    vals = np.stack(list(map(lambda x: batch[x], params)))
+    valid = np.stack(list(map(lambda x: batch[x + "_valid"], params)))
+    counts = np.cumsum(valid, axis=1)
+    recents = np.argmax(valid, axis=1)
+    highs = _get_prefix_arg(vals, valid, INT_MIN, np.maximum)
+    lows = _get_prefix_arg(vals, valid, INT_MAX, np.minimum)
+    for name, wsize in sizes.items():
+        for i, param in enumerate(params):
+            count = 0 if wsize == 0 else int(counts[i, wsize - 1])
+            ret[name][param] = {
+                "count": count,
+                "recent_index": -1 if count == 0 else int(recents[i]),
+                "high_index": -1 if count == 0 else int(highs[i, wsize - 1]),
+                "low_index": -1 if count == 0 else int(lows[i, wsize - 1]),
+            }
+    return ret
+
+
+def _get_value(batch: RowBatch, param: str, idx: int):
+    return None if idx < 0 else rowbatch.to_decimal(batch[param][idx])
+
+
+def _get_datetime(batch: RowBatch, idx: int):
+    return None if idx < 0 else rowbatch.to_datetime(batch["datetime"][idx])
+
+
+def summarize(
+    batch: RowBatch,
+    windows: Windows = DEFAULT_WINDOWS,
+    end: np.datetime64 | None = None,
+):
+    """
+    Reports recent, high and low values for every parameter over each
+    window, such as the 24 hour, 7 day and 30 day extremes.
+    """
+    aggs = aggregate(batch, windows, end)
+    ret: dict[str, dict[str, ParamSummary]] = {}
+    for name, params in aggs.items():
+        ret[name] = {}
+        for param, agg in params.items():
+            ret[name][param] = {
+                "count": agg["count"],
+                "recent_value": _get_value(batch, param, agg["recent_index"]),
+                "recent_datetime": _get_datetime(batch, agg["recent_index"]),
+                "high_value": _get_value(batch, param, agg["high_index"]),
+                "high_datetime": _get_datetime(batch, agg["high_index"]),
+                "low_value": _get_value(batch, param, agg["low_index"]),
+                "low_datetime": _get_datetime(batch, agg["low_index"]),
+            }
+    return ret
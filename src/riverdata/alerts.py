@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+"""
+Alert rules evaluated over site stats after every refresh.
+
+Rules compare one value of a site's stats against a limit:
+
+- `threshold`: the most recent reading
+- `predicted`: the predicted next reading
+- `rate`: the change per hour between the last two readings seen
+
+Each rule fires when its value reaches `value` and clears only once it
+falls back past `clear`, so readings hovering around the limit do not
+flap. `update` returns only the rules whose state changed.
+
+Rules are compiled into arrays once, and the latest values of every
+site are kept in a matrix, so evaluating all rules after a refresh is
+a handful of NumPy operations however many rules there are.
+"""
+
+from typing import TypedDict
+from decimal import Decimal
+import datetime
+import json
+import math
+
+import numpy as np
+
+from riverdata import metrics
+from riverdata.types import Stat, Stats
+
+KINDS = ("threshold", "predicted", "rate")
+
+PARAMS = ("discharge", "temp")
+
+OPS = {"above": 1.0, "below": -1.0}
+
+RATE_SECONDS = 60 * 60
+
+
+class Rule(TypedDict):
+    rule_id: str
+    site_no: str
+    kind: str
+    param: str
+    op: str
+    value: Decimal
+    clear: Decimal | None
+
+
+class AlertEvent(TypedDict):
+    rule_id: str
+    site_no: str
+    kind: str
+    param: str
+    firing: bool
+    value: float
+    datetime: datetime.datetime | None
+
+
+def _check_rule(rule: Rule):
+    if rule["kind"] not in KINDS:
+        raise ValueError("Rule %s: unknown kind %r" % (rule["rule_id"], rule["kind"]))
+    if rule["param"] not in PARAMS:
+        raise ValueError("Rule %s: unknown param %r" % (rule["rule_id"], rule["param"]))
+    if rule["op"] not in OPS:
+        raise ValueError("Rule %s: unknown op %r" % (rule["rule_id"], rule["op"]))
+    if (
+        rule["clear"] is not None
+        and OPS[rule["op"]] * float(rule["clear"] - rule["value"]) > 0
+    ):
+        raise ValueError(
+            "Rule %s: clear must not be %s value" % (rule["rule_id"], rule["op"])
+        )
+    return True
+
+
+def load_rules(rules_filepath: str):
+    """
+    Reads rules from a JSON list. `value` and `clear` may be given as
+    numbers or strings, and `clear` defaults to `value`.
+    """
+    with open(rules_filepath, "r", encoding="utf-8") as fh:
+        docs = json.load(fh)
+    ret: list[Rule] = []
+    for doc in docs:
+        rule: Rule = {
+            "rule_id": str(doc["rule_id"]),
+            "site_no": str(doc["site_no"]),
+            "kind": doc["kind"],
+            "param": doc["param"],
+            "op": doc["op"],
+            "value": Decimal(str(doc["value"])),
+            "clear": None if doc.get("clear") is None else Decimal(str(doc["clear"])),
+        }
+        _check_rule(rule)
+        ret.append(rule)
+    return ret
+
+
+def _to_float(val: Decimal | None):
+    return math.nan if val is None else float(val)
+
+
+class AlertEngine:
+    """
+    Evaluates `rules` against the stats passed to `update`.
+
+    All rules start cleared. A rule whose value is unknown, such as a
+    site with no recent reading or a rate before a second reading has
+    been seen, keeps its state.
+    """
+
+    def __init__(self, rules: list[Rule]):
+        for rule in rules:
+            _check_rule(rule)
+        self.rules = rules
+        self._slots: dict[str, int] = {}
+        for rule in rules:
+            self._slots.setdefault(rule["site_no"], len(self._slots))
+        sites = len(self._slots)
+        self._values = np.full((sites, len(PARAMS) * len(KINDS)), math.nan)
+        self._last_values = np.full((sites, len(PARAMS)), math.nan)
+        self._last_times = np.full((sites, len(PARAMS)), math.nan)
+        self._last_datetimes: list[list[datetime.datetime | None]] = list(
+            map(lambda x: [None] * len(PARAMS), range(sites))
+        )
+        self._rule_slots = np.array(
+            list(map(lambda x: self._slots[x["site_no"]], rules)), dtype=np.intp
+        )
+        self._rule_params = np.array(
+            list(map(lambda x: PARAMS.index(x["param"]), rules)), dtype=np.intp
+        )
+        self._rule_metrics = self._rule_params * len(KINDS) + np.array(
+            list(map(lambda x: KINDS.index(x["kind"]), rules)), dtype=np.intp
+        )
+        self._signs = np.array(list(map(lambda x: OPS[x["op"]], rules)))
+        self._triggers = self._signs * np.array(
+            list(map(lambda x: float(x["value"]), rules))
+        )
+        self._releases = self._signs * np.array(
+            list(
+                map(
+                    lambda x: float(x["value"] if x["clear"] is None else x["clear"]),
+                    rules,
+                )
+            )
+        )
+        self.active = np.zeros(len(rules), dtype=bool)
+
+    def _update_site(self, slot: int, stat: Stat):
+        row = self._values[slot]
+        for idx, param in enumerate(PARAMS):
+            base = idx * len(KINDS)
+            recent = stat[param + "_recent_value"]
+            recent_dt = stat[param + "_recent_datetime"]
+            row[base + KINDS.index("threshold")] = _to_float(recent)
+            row[base + KINDS.index("predicted")] = _to_float(
+                stat[param + "_prediction_value"]
+            )
+            if recent is None or recent_dt is None:
+                row[base + KINDS.index("rate")] = math.nan
+                continue
+            secs = recent_dt.timestamp()
+            last_secs = self._last_times[slot, idx]
+            if secs <= last_secs:
+                continue
+            if not math.isnan(last_secs):
+                row[base + KINDS.index("rate")] = (
+                    (float(recent) - self._last_values[slot, idx])
+                    * RATE_SECONDS
+                    / (secs - last_secs)
+                )
+            self._last_values[slot, idx] = float(recent)
+            self._last_times[slot, idx] = secs
+            self._last_datetimes[slot][idx] = recent_dt
+        return True
+
+    def update(self, stats: Stats):
+        """
+        Takes the stats of a refresh, which may cover only some sites,
+        and returns an event for every rule that fired or cleared.
+        """
+        with metrics.timed("alerts") as timer:
+            for site_no, stat in stats.items():
+                slot = self._slots.get(site_no)
+                if slot is not None:
+                    self._update_site(slot, stat)
+            vals = self._values[self._rule_slots, self._rule_metrics]
+            signed = vals * self._signs
+            # Comparisons with NaN are False, so unknown values change nothing.
+            fired = ~self.active & (signed >= self._triggers)
+            cleared = self.active & (signed < self._releases)
+            changed = np.flatnonzero(fired | cleared)
+            self.active[changed] = ~self.active[changed]
+            timer.rows = len(self.rules)
+        ret: list[AlertEvent] = []
+        for idx in changed:
+            rule = self.rules[idx]
+            ret.append(
+                {
+                    "rule_id": rule["rule_id"],
+                    "site_no": rule["site_no"],
+                    "kind": rule["kind"],
+                    "param": rule["param"],
+                    "firing": bool(self.active[idx]),
+                    "value": float(vals[idx]),
+                    "datetime": self._last_datetimes[self._rule_slots[idx]][
+                        self._rule_params[idx]
+                    ],
+                }
+            )
+        return ret
+
+    def get_firing(self):
+        """
+        Returns the rules that are firing now.
+        """
+        return list(map(lambda x: self.rules[x], np.flatnonzero(self.active)))
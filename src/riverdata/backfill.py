@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+"""
+Resumable historical backfill into the observation store.
+
+A date range is pulled in one request per batch of sites per calendar
+month, by a pool of worker threads. Readings are merged into the
+monthly partitions of `riverdata.observations` as each request
+completes, and the request is then recorded in an append-only
+checkpoint log. A rerun skips the site months already recorded, so an
+interrupted or partly failed backfill picks up where it stopped.
+"""
+
+from typing import TypedDict
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import json
+import logging
+import os
+import threading
+
+import requests
+
+from riverdata import fetch, observations, rollup, storage
+from riverdata.sites import SITES
+from riverdata.types import Site
+
+CHECKPOINT_NAME = ".backfill.log"
+
+BACKFILL_BATCH_SIZE = 10
+
+logger = logging.getLogger(__name__)
+
+
+class BackfillTask(TypedDict):
+    sites: list[Site]
+    begin_date: datetime.date
+    end_date: datetime.date
+
+
+class BackfillResult(TypedDict):
+    tasks: int
+    skipped: int
+    failed: int
+    added: int
+
+
+def _iter_months(begin_date: datetime.date, end_date: datetime.date):
+    """
+    Yields inclusive (first, last) date ranges covering `begin_date` to
+    `end_date`, split on calendar months.
+    """
+    start = begin_date
+    while start <= end_date:
+        next_month = (start.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+        yield (start, min(end_date, next_month - datetime.timedelta(days=1)))
+        start = next_month
+
+
+def _get_checkpoint_key(site_no: str, begin_date: str):
+    return "%s/%s" % (site_no, begin_date)
+
+
+def _read_checkpoint(checkpoint_filepath: str):
+    """
+    Returns the keys of completed site months. A last line without a
+    newline is a record cut short by an interrupted run and is ignored.
+    """
+    ret: set[str] = set()
+    if not os.path.exists(checkpoint_filepath):
+        return ret
+    with open(checkpoint_filepath, "r", encoding="utf-8") as fh:
+        for line in fh:
+            if not line.endswith("\n"):
+                break
+            entry = json.loads(line)
+            for site_no in entry["site_nos"]:
+                ret.add(_get_checkpoint_key(site_no, entry["begin_date"]))
+    return ret
+
+
+def _build_tasks(
+    sites: list[Site],
+    begin_date: datetime.date,
+    end_date: datetime.date,
+    batch_size: int,
+    done: set[str],
+):
+    tasks: list[BackfillTask] = []
+    skipped = 0
+    for first, last in _iter_months(begin_date, end_date):
+        pending = list(
+            filter(
+                lambda x: _get_checkpoint_key(x["site_no"], first.isoformat())
+                not in done,
+                sites,
+            )
+        )
+        skipped += len(sites) - len(pending)
+        for batch in fetch.chunk_sites(pending, batch_size):
+            tasks.append({"sites": batch, "begin_date": first, "end_date": last})
+    return (tasks, skipped)
+
+
+class _Backfill:
+    def __init__(self, store_dir: str, checkpoint_filepath: str):
+        self.store_dir = store_dir
+        self.checkpoint_filepath = checkpoint_filepath
+        self._checkpoint_lock = threading.Lock()
+        self._site_locks: dict[str, threading.Lock] = {}
+        self._site_locks_lock = threading.Lock()
+
+    def _get_site_lock(self, site_no: str):
+        with self._site_locks_lock:
+            if site_no not in self._site_locks:
+                self._site_locks[site_no] = threading.Lock()
+            return self._site_locks[site_no]
+
+    def _record(self, task: BackfillTask):
+        entry = {
+            "site_nos": list(map(lambda x: x["site_no"], task["sites"])),
+            "begin_date": task["begin_date"].isoformat(),
+            "end_date": task["end_date"].isoformat(),
+        }
+        with self._checkpoint_lock:
+            with open(self.checkpoint_filepath, "a", encoding="utf-8") as fh:
+                fh.write(json.dumps(entry))
+                fh.write("\n")
+                fh.flush()
+                os.fsync(fh.fileno())
+        return True
+
+    def run_task(self, task: BackfillTask, session: requests.Session):
+        """
+        Fetches one batch of sites for one month and merges the readings
+        into the store. Returns the number of readings added, or None if
+        the request failed.
+        """
+        site_nos = ",".join(map(lambda x: x["site_no"], task["sites"]))
+        try:
+            with fetch.fetch_rdb(
+                site_nos, task["begin_date"], session, end_date=task["end_date"]
+            ) as resp:
+                lines = resp.iter_lines(decode_unicode=True)
+                groups = fetch.group_by_site(fetch.parse_rdb(lines))
+        except requests.RequestException as exc:
+            logger.warning(
+                "Backfill of sites %s from %s failed: %s",
+                site_nos,
+                task["begin_date"].isoformat(),
+                exc,
+            )
+            return None
+        added = 0
+        for site in task["sites"]:
+            if site["site_no"] not in groups:
+                continue
+            rows = groups[site["site_no"]]
+            batch = fetch.normalize_batch(site, rows)
+            agencies = list(map(lambda x: x["agency"], rows))[::-1]
+            with self._get_site_lock(site["site_no"]):
+                added += observations.merge_batch(
+                    self.store_dir, site["site_no"], batch, agencies
+                )
+                rollup.update_times(self.store_dir, site["site_no"], batch["datetime"])
+        self._record(task)
+        return added
+
+
+def backfill(
+    store_dir: str,
+    begin_date: datetime.date,
+    end_date: datetime.date,
+    sites: list[Site] = SITES,
+    concurrency: int = fetch.FETCH_CONCURRENCY,
+    batch_size: int = BACKFILL_BATCH_SIZE,
+    checkpoint_filepath: str | None = None,
+):
+    """
+    Pulls readings from `begin_date` to `end_date`, inclusive, into the
+    observation store at `store_dir`.
+
+    The checkpoint log defaults to `<store_dir>/.backfill.log`. Site
+    months it records are skipped, and failed requests are left out of
+    it so that running the same backfill again retries them. Merging
+    deduplicates readings, so overlapping reruns are harmless.
+    """
+    checkpoint_filepath = (
+        os.path.join(store_dir, CHECKPOINT_NAME)
+        if checkpoint_filepath is None
+        else checkpoint_filepath
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint_filepath)), exist_ok=True)
+    done = _read_checkpoint(checkpoint_filepath)
+    tasks, skipped = _build_tasks(sites, begin_date, end_date, max(1, batch_size), done)
+    ret: BackfillResult = {
+        "tasks": len(tasks),
+        "skipped": skipped,
+        "failed": 0,
+        "added": 0,
+    }
+    if len(tasks) == 0:
+        return ret
+    storage.trim_log(checkpoint_filepath)
+    runner = _Backfill(store_dir, checkpoint_filepath)
+    workers = max(1, min(concurrency, len(tasks)))
+    with fetch.make_session(workers) as session:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for added in pool.map(lambda x: runner.run_task(x, session), tasks):
+                if added is None:
+                    ret["failed"] += 1
+                    continue
+                ret["added"] += added
+    return ret
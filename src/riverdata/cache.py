@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+"""
+On-disk cache of raw NWIS responses.
+
+Responses are stored by a hash of the request URL and params, as
+`<cache_dir>/<key[:2]>/<key>.rdb` with a `<key>.json` sidecar holding
+the request and the time it was fetched. Entries older than the TTL are
+not served, but are kept for offline replay until the cache grows
+past `max_bytes` and the least recently used responses are evicted.
+"""
+
+from typing import TypedDict
+import hashlib
+import json
+import os
+import threading
+import time
+
+from riverdata.fileio import atomic_open
+
+DEFAULT_TTL = 10 * 60.0
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+BODY_SUFFIX = ".rdb"
+
+META_SUFFIX = ".json"
+
+
+class CacheEntry(TypedDict):
+    key: str
+    url: str
+    params: dict[str, str]
+    fetched_at: float
+    size: int
+
+
+def make_key(url: str, params: dict[str, str]):
+    doc = json.dumps([url, params], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(doc.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    A size-bounded LRU cache of response bodies with a TTL.
+
+    `ttl` of None serves entries regardless of age. Reads refresh the
+    body file's mtime, which is the recency eviction goes by.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        ttl: float | None = DEFAULT_TTL,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size: int | None = None
+
+    def _get_path(self, key: str, suffix: str):
+        return os.path.join(self.cache_dir, key[:2], key + suffix)
+
+    def _read_meta(self, key: str) -> CacheEntry | None:
+        try:
+            with open(self._get_path(key, META_SUFFIX), "r", encoding="utf-8") as fh:
+                return json.load(fh)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _iter_keys(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for dirname in sorted(os.listdir(self.cache_dir)):
+            dirpath = os.path.join(self.cache_dir, dirname)
+            if not os.path.isdir(dirpath):
+                continue
+            for filename in sorted(os.listdir(dirpath)):
+                if filename.endswith(META_SUFFIX):
+                    yield filename[: -len(META_SUFFIX)]
+
+    def _get_size(self):
+        if self._size is None:
+            self._size = sum(map(lambda x: x["size"], self.entries()))
+        return self._size
+
+    def get(self, url: str, params: dict[str, str]):
+        """
+        Returns the cached body of a request, or None if it is missing
+        or older than the TTL.
+        """
+        key = make_key(url, params)
+        entry = self._read_meta(key)
+        if entry is None:
+            return None
+        if self.ttl is not None and time.time() - entry["fetched_at"] > self.ttl:
+            return None
+        text = self.read(entry)
+        if text is not None:
+            try:
+                os.utime(self._get_path(key, BODY_SUFFIX))
+            except FileNotFoundError:
+                pass
+        return text
+
+    def read(self, entry: CacheEntry):
+        """
+        Returns the body of an entry regardless of its age.
+        """
+        try:
+            with open(
+                self._get_path(entry["key"], BODY_SUFFIX), "r", encoding="utf-8"
+            ) as fh:
+                return fh.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, url: str, params: dict[str, str], text: str):
+        key = make_key(url, params)
+        data = text.encode("utf-8")
+        entry: CacheEntry = {
+            "key": key,
+            "url": url,
+            "params": params,
+            "fetched_at": time.time(),
+            "size": len(data),
+        }
+        old = self._read_meta(key)
+        with atomic_open(self._get_path(key, BODY_SUFFIX), "wb") as fh:
+            fh.write(data)
+        with atomic_open(self._get_path(key, META_SUFFIX), "w", encoding="utf-8") as fh:
+            json.dump(entry, fh)
+        with self._lock:
+            self._size = (
+                self._get_size() + entry["size"] - (0 if old is None else old["size"])
+            )
+            if self._size > self.max_bytes:
+                self._evict()
+        return entry
+
+    def entries(self):
+        """
+        Returns every entry in the cache, whatever its age.
+        """
+        ret: list[CacheEntry] = []
+        for key in self._iter_keys():
+            entry = self._read_meta(key)
+            if entry is not None:
+                ret.append(entry)
+        return ret
+
+    def _remove(self, key: str):
+        for suffix in (META_SUFFIX, BODY_SUFFIX):
+            try:
+                os.unlink(self._get_path(key, suffix))
+            except FileNotFoundError:
+                pass
+        return True
+
+    def _get_used(self, entry: CacheEntry):
+        try:
+            return os.stat(self._get_path(entry["key"], BODY_SUFFIX)).st_mtime
+        except FileNotFoundError:
+            return 0.0
+
+    def _evict(self):
+        entries = sorted(self.entries(), key=self._get_used)
+        size = sum(map(lambda x: x["size"], entries))
+        removed = 0
+        for entry in entries:
+            if size <= self.max_bytes:
+                break
+            self._remove(entry["key"])
+            size -= entry["size"]
+            removed += 1
+        self._size = size
+        return removed
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache fits in
+        `max_bytes`. Returns the number of entries removed.
+        """
+        with self._lock:
+            return self._evict()
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._iter_keys()):
+                self._remove(key)
+            self._size = 0
+        return True
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+"""
+Command line entry point.
+
+Modules that pull in requests or NumPy are imported inside the commands
+that need them, so commands that only read stats files start quickly.
+"""
+
+import argparse
+import datetime
+import json
+import sys
+
+from riverdata import storage
+from riverdata.cache import DEFAULT_TTL, ResponseCache
+from riverdata.jsonlib import NewJSONEncoder
+from riverdata.types import Stats
+
+FORMATS = ("json", "incremental", "snapshot")
+
+
+def _print_json(obj: object):
+    json.dump(obj, sys.stdout, ensure_ascii=False, indent=2, cls=NewJSONEncoder)
+    sys.stdout.write("\n")
+    return True
+
+
+def _write_stats(stats: Stats, output: str | None, fmt: str):
+    if output is None:
+        return _print_json(stats)
+    if fmt == "snapshot":
+        return storage.write_sites_snapshot(output, stats)
+    if fmt == "incremental":
+        storage.write_sites_incremental(output, stats)
+        return True
+    return storage.write_sites(output, stats)
+
+
+def _setup_logging(args: argparse.Namespace):
+    import logging
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    return True
+
+
+def _make_cache(args: argparse.Namespace, ttl: float | None):
+    if args.cache_dir is None:
+        return None
+    return ResponseCache(args.cache_dir, ttl=ttl)
+
+
+def _cmd_fetch(args: argparse.Namespace):
+    from riverdata import fetch
+
+    _setup_logging(args)
+    stats = fetch.process_all_sites(
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        store_dir=args.store_dir,
+        cache=_make_cache(args, args.cache_ttl),
+    )
+    _write_stats(stats, args.output, args.format)
+    return 0
+
+
+def _cmd_replay(args: argparse.Namespace):
+    from riverdata import fetch
+
+    _setup_logging(args)
+    stats = fetch.replay_all_sites(_make_cache(args, None))
+    _write_stats(stats, args.output, args.format)
+    return 0
+
+
+def _cmd_backfill(args: argparse.Namespace):
+    from riverdata import backfill
+    from riverdata.registry import get_registry
+
+    _setup_logging(args)
+    registry = get_registry()
+    sites = (
+        registry.sites
+        if len(args.site) == 0
+        else list(filter(None, map(registry.get_site, args.site)))
+    )
+    result = backfill.backfill(
+        args.store_dir,
+        datetime.date.fromisoformat(args.begin),
+        datetime.date.fromisoformat(args.end),
+        sites=sites,
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        checkpoint_filepath=args.checkpoint,
+    )
+    _print_json(result)
+    return 0 if result["failed"] == 0 else 1
+
+
+def _cmd_rebuild(args: argparse.Namespace):
+    from riverdata import parallel
+    from riverdata.registry import get_registry
+
+    _setup_logging(args)
+    registry = get_registry()
+    sites = (
+        registry.sites
+        if len(args.site) == 0
+        else list(filter(None, map(registry.get_site, args.site)))
+    )
+    docs: list[str] = []
+    for filepath in args.files:
+        with open(filepath, "r", encoding="utf-8") as fh:
+            docs.append(fh.read())
+    stats = parallel.build_stats_parallel(
+        docs,
+        sites,
+        datetime.date.fromisoformat(args.begin),
+        workers=args.workers,
+        chunk_rows=args.chunk_rows,
+    )
+    _write_stats(stats, args.output, args.format)
+    return 0
+
+
+def _cmd_rollup(args: argparse.Namespace):
+    from riverdata import rollup
+    from riverdata.registry import get_registry
+
+    site_nos = (
+        list(map(lambda x: x["site_no"], get_registry().sites))
+        if len(args.site) == 0
+        else args.site
+    )
+    for site_no in site_nos:
+        rollup.rebuild(args.store_dir, site_no)
+    return 0
+
+
+def _make_alert_handler(rules_filepath: str):
+    from riverdata import alerts
+
+    engine = alerts.AlertEngine(alerts.load_rules(rules_filepath))
+
+    def _on_stats(stats: Stats):
+        for event in engine.update(stats):
+            sys.stdout.write(json.dumps(event, ensure_ascii=False, cls=NewJSONEncoder))
+            sys.stdout.write("\n")
+        sys.stdout.flush()
+
+    return _on_stats
+
+
+def _make_predictor(args: argparse.Namespace):
+    if args.predict_readings is None and args.predict_seconds is None:
+        return None
+    from riverdata.online import OnlinePredictor
+
+    return OnlinePredictor(size=args.predict_readings, seconds=args.predict_seconds)
+
+
+def _cmd_poll(args: argparse.Namespace):
+    from riverdata.scheduler import Scheduler
+
+    _setup_logging(args)
+    scheduler = Scheduler(
+        stats_filepath=args.stats,
+        snapshot_filepath=args.snapshot,
+        store_dir=args.store_dir,
+        concurrency=args.concurrency,
+        on_stats=None if args.rules is None else _make_alert_handler(args.rules),
+        predictor=_make_predictor(args),
+    )
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        scheduler.stop()
+    return 0
+
+
+def _cmd_serve(args: argparse.Namespace):
+    from riverdata import server
+
+    _setup_logging(args)
+    httpd = server.make_server(args.path, host=args.host, port=args.port)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+    return 0
+
+
+def _cmd_parks(args: argparse.Namespace):
+    _print_json(storage.read_parks_stats(args.path, region=args.region))
+    return 0
+
+
+def _cmd_site(args: argparse.Namespace):
+    stat = storage.read_site_stat(args.path, args.site_no)
+    if stat is None:
+        sys.stderr.write("No stats for site %s\n" % args.site_no)
+        return 1
+    _print_json(stat)
+    return 0
+
+
+def _add_fetch_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--store-dir", default=None, help="observation store")
+    return parser
+
+
+def _add_output_args(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--output", default=None, help="stats file, printed to stdout if not given"
+    )
+    parser.add_argument("--format", choices=FORMATS, default="json")
+    return parser
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="riverdata")
+    parser.add_argument("--verbose", action="store_true")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("fetch", help="fetch stats for every site")
+    _add_fetch_args(cmd)
+    _add_output_args(cmd)
+    cmd.add_argument("--batch-size", type=int, default=25)
+    cmd.add_argument("--cache-dir", default=None, help="raw response cache")
+    cmd.add_argument("--cache-ttl", type=float, default=DEFAULT_TTL)
+    cmd.set_defaults(func=_cmd_fetch)
+
+    cmd = commands.add_parser("replay", help="rebuild stats from cached responses")
+    _add_output_args(cmd)
+    cmd.add_argument("--cache-dir", required=True, help="raw response cache")
+    cmd.set_defaults(func=_cmd_replay)
+
+    cmd = commands.add_parser("backfill", help="pull a date range into the store")
+    cmd.add_argument("--store-dir", required=True, help="observation store")
+    cmd.add_argument("--begin", required=True, help="first date, YYYY-MM-DD")
+    cmd.add_argument("--end", required=True, help="last date, YYYY-MM-DD")
+    cmd.add_argument("--site", action="append", default=[], help="site number")
+    cmd.add_argument("--concurrency", type=int, default=8)
+    cmd.add_argument("--batch-size", type=int, default=10)
+    cmd.add_argument("--checkpoint", default=None, help="checkpoint log")
+    cmd.set_defaults(func=_cmd_backfill)
+
+    cmd = commands.add_parser(
+        "rebuild", help="build stats from RDB files across processes"
+    )
+    _add_output_args(cmd)
+    cmd.add_argument("files", nargs="+", help="RDB files, oldest first")
+    cmd.add_argument("--begin", required=True, help="first date, YYYY-MM-DD")
+    cmd.add_argument("--site", action="append", default=[], help="site number")
+    cmd.add_argument("--workers", type=int, default=None, help="defaults to CPUs")
+    cmd.add_argument("--chunk-rows", type=int, default=50000)
+    cmd.set_defaults(func=_cmd_rebuild)
+
+    cmd = commands.add_parser("rollup", help="rebuild rollups from the store")
+    cmd.add_argument("--store-dir", required=True, help="observation store")
+    cmd.add_argument("--site", action="append", default=[], help="site number")
+    cmd.set_defaults(func=_cmd_rollup)
+
+    cmd = commands.add_parser("poll", help="keep polling every site")
+    _add_fetch_args(cmd)
+    cmd.add_argument("--stats", default=None, help="JSON stats document")
+    cmd.add_argument("--snapshot", default=None, help="binary stats snapshot")
+    cmd.add_argument("--rules", default=None, help="alert rules, JSON")
+    window = cmd.add_mutually_exclusive_group()
+    window.add_argument(
+        "--predict-readings", type=int, default=None, help="streaming fit window"
+    )
+    window.add_argument(
+        "--predict-seconds", type=int, default=None, help="streaming fit window"
+    )
+    cmd.set_defaults(func=_cmd_poll)
+
+    cmd = commands.add_parser("serve", help="serve stats over HTTP")
+    cmd.add_argument("path", help="stats file or snapshot")
+    cmd.add_argument("--host", default="127.0.0.1")
+    cmd.add_argument("--port", type=int, default=8080)
+    cmd.set_defaults(func=_cmd_serve)
+
+    cmd = commands.add_parser("parks", help="show park stats")
+    cmd.add_argument("path", help="stats file or snapshot")
+    cmd.add_argument("--region", default=None)
+    cmd.set_defaults(func=_cmd_parks)
+
+    cmd = commands.add_parser("site", help="show one site's stats")
+    cmd.add_argument("path", help="stats file or snapshot")
+    cmd.add_argument("site_no")
+    cmd.set_defaults(func=_cmd_site)
+    return parser
+
+
+def main(argv: list[str] | None = None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,44 +1,33 @@
 #!/usr/bin/env python3
 
-from typing import TypedDict, cast
+from typing import TypedDict, Iterable, Iterator, cast
 from io import StringIO
-import csv
 import datetime
 import zoneinfo
 from decimal import Decimal
 import re
 from pprint import pprint
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import logging
 
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from riverdata.sites import SITES
 from riverdata.types import Stat, Stats, Site
-from riverdata.math import get_prediction_info
-
-
-class FetchResult(TypedDict):
-    text: str
-    url: str
-
-
-class NormRowBase(TypedDict):
-    site: str
-    agency: str
-    datetime: datetime.datetime
-    timezone: str
-
-
-class NormRowDischarge(NormRowBase):
-    discharge: Decimal | None
-
-
-class NormRowTemperature(NormRowBase):
-    temperature: Decimal | None
-
-
-class NormRow(NormRowDischarge, NormRowTemperature):
-    discharge: Decimal | None
-    temperature: Decimal | None
+from riverdata import aggregate, metrics, observations, query, rollup, rowbatch
+from riverdata.aggregate import ParamAggregate
+from riverdata.cache import ResponseCache
+from riverdata.rowbatch import RowBatch
+from riverdata.math import (
+    PREDICTION_COUNT,
+    FixedPrediction,
+    get_prediction_info_fixed,
+    get_prediction_infos_fixed,
+)
 
 
 class OrigRow(TypedDict):
@@ -63,6 +52,11 @@ class StatDischarge(TypedDict):
     low_datetime: datetime.datetime
 
 
+class SiteResult(TypedDict):
+    stat: Stat | None
+    batch: RowBatch
+
+
 class StatTemp(TypedDict):
     recent_value: Decimal
     recent_datetime: datetime.datetime
@@ -74,12 +68,19 @@ class StatTemp(TypedDict):
     low_datetime: datetime.datetime
 
 
-class DocParts(TypedDict):
-    headers: list[str]
-    data: str
+FETCH_CONCURRENCY = 8
+
+FETCH_BATCH_SIZE = 25
+
+MAX_CATCHUP_DAYS = 30
+
+FETCH_TIMEOUT: tuple[float, float] = (5.0, 30.0)
+
+FETCH_RETRIES = 3
 
+FETCH_BACKOFF = 0.5
 
-PREDICTION_COUNT = 8
+FETCH_RETRY_STATUSES = (429, 500, 502, 503, 504)
 
 URL = "https://waterdata.usgs.gov/nwis/uv"
 
@@ -94,6 +95,8 @@ DATA_FIELDS: list[tuple[str, str]] = [
     (r"^\d+_00010_cd$", "temperature_provisional"),
 ]
 
+logger = logging.getLogger(__name__)
+
 TZ_FIXES = {
     "HDT": "Pacific/Honolulu",
     "AKDT": "America/Anchorage",
@@ -107,8 +110,16 @@ TZ_FIXES = {
 }
 
 
-def _build_url_params(site_no: str, begin_dt: datetime.date):
-    return {
+def _build_url_params(
+    site_no: str, begin_dt: datetime.date, end_dt: datetime.date | None = None
+):
+    """
+    Builds NWIS query params.
+
+    `site_no` may be a single site number or a comma-separated list.
+    Without an `end_dt` the range runs up to the most recent reading.
+    """
+    ret = {
         "cb_00010": "on",
         "cb_00060": "on",
         "format": "rdb",
@@ -116,24 +127,138 @@ def _build_url_params(site_no: str, begin_dt: datetime.date):
         "period": "",
         "begin_date": begin_dt.isoformat(),
     }
+    if end_dt is not None:
+        ret["end_date"] = end_dt.isoformat()
+    return ret
+
+
+def make_session(
+    pool_size: int = FETCH_CONCURRENCY,
+    retries: int = FETCH_RETRIES,
+    backoff: float = FETCH_BACKOFF,
+):
+    """
+    Builds a keep-alive session shared by all fetch workers.
+
+    The connection pool is sized to the worker count so that every
+    worker can hold a connection open to the USGS host, and transient
+    failures are retried with exponential backoff.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=FETCH_RETRY_STATUSES,
+        allowed_methods=frozenset(["GET"]),
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
 
+def _get_retry_count(resp: requests.Response):
+    retries = getattr(getattr(resp, "raw", None), "retries", None)
+    return 0 if retries is None else len(retries.history)
 
-def _fetch(site: Site, begin_date: datetime.date):
+
+def _get_bytes_read(resp: requests.Response):
+    tell = getattr(getattr(resp, "raw", None), "tell", None)
+    return 0 if tell is None else tell()
+
+
+def fetch_rdb(
+    site_nos: str,
+    begin_date: datetime.date,
+    session: requests.Session | None = None,
+    timeout: tuple[float, float] = FETCH_TIMEOUT,
+    end_date: datetime.date | None = None,
+):
+    """
+    Opens a streaming NWIS request for one or more comma-separated site
+    numbers. The body is left unread so it can be parsed as it arrives.
+    """
+    params = _build_url_params(site_nos, begin_date, end_date)
+    getter = requests if session is None else session
+    with metrics.timed("request") as timer:
+        resp = getter.get(URL, params=params, timeout=timeout, stream=True)
+        timer.retries = _get_retry_count(resp)
+        resp.raise_for_status()
+    if resp.encoding is None:
+        resp.encoding = "utf-8"
+    return resp
+
+
+def build_site_url(site: Site, begin_date: datetime.date):
     params = _build_url_params(site["site_no"], begin_date)
-    resp = requests.get(URL, params=params)
-    return cast(FetchResult, {"text": resp.text, "url": resp.url})
+    req = requests.Request("GET", URL, params=params).prepare()
+    return cast(str, req.url)
 
 
-def _cleanup(text: str):
-    lines1 = text.splitlines()
-    lines2 = list(filter(lambda x: not x.startswith("#"), lines1))
-    if len(lines2) == 0:
-        return None
-    line_h = _transform_csv_headers(lines2[0].split("\t"))
-    lines3 = list(filter(lambda x: x[0] > 1, enumerate(lines2)))
-    lines4 = list(map(lambda x: x[1], lines3))
-    clean = "\n".join(lines4)
-    ret: DocParts = {"headers": line_h, "data": clean}
+def iter_lines(raw: str):
+    return iter(StringIO(raw))
+
+
+def _tee_lines(lines: Iterable[str], buf: list[str]):
+    for line in lines:
+        buf.append(line)
+        yield line
+
+
+def parse_rdb(lines: Iterable[str]) -> Iterator[OrigRow]:
+    """
+    Parses RDB lines into rows in a single pass.
+
+    Comment lines are skipped, the header line of each table is mapped
+    to field names once, and the format line that follows it is
+    dropped. A multi-site response holds one table per site, so a
+    comment block after data starts a new table.
+    """
+    headers: list[str] | None = None
+    skip_format = False
+    in_comments = True
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line.startswith("#"):
+            in_comments = True
+            continue
+        if line == "":
+            continue
+        if in_comments or headers is None:
+            headers = _transform_csv_headers(line.split("\t"))
+            skip_format = True
+            in_comments = False
+            continue
+        if skip_format:
+            skip_format = False
+            continue
+        yield cast(OrigRow, dict(zip(headers, line.split("\t"))))
+
+
+def group_by_site(rows: Iterable[OrigRow]):
+    """
+    Groups the rows of a multi-site response on their `site_no`.
+    """
+    ret: dict[str, list[OrigRow]] = {}
+    for row in rows:
+        ret.setdefault(row["site_no"], []).append(row)
+    return ret
+
+
+def chunk_sites(sites: list[Site], size: int):
+    """
+    Groups sites into request batches of at most `size`.
+
+    Sites are grouped by region first so that a batch covers stations
+    that usually share a timezone and reporting schedule.
+    """
+    regions: dict[str, list[Site]] = {}
+    for site in sites:
+        regions.setdefault(site["region"], []).append(site)
+    ret: list[list[Site]] = []
+    for group in regions.values():
+        for i in range(0, len(group), size):
+            ret.append(group[i : i + size])
     return ret
 
 
@@ -147,15 +272,14 @@ def _transform_csv_headers(headers: list[str]):
     return list(map(_transform, headers))
 
 
-def _to_csv(doc: DocParts):
-    fh = StringIO(doc["data"])
-    reader = csv.DictReader(fh, doc["headers"], delimiter="\t")
-    revrows = list(reversed(list(reader)))
-    outrows = cast(list[OrigRow], revrows)
-    return outrows
-
-
+@functools.lru_cache(maxsize=None)
 def _get_tz(tzname1: str, tzname2: str):
+    """
+    Resolves a row's timezone code, falling back to the site timezone,
+    then `TZ_FIXES`, then UTC. Results are cached per pair of names since
+    a document only ever holds a handful of distinct codes.
+    """
+
     def _find(tz: str):
         try:
             return zoneinfo.ZoneInfo(tz)
@@ -178,6 +302,7 @@ def _get_tz(tzname1: str, tzname2: str):
     return tzobj4
 
 
+@functools.lru_cache(maxsize=None)
 def _get_tz_utc():
     return zoneinfo.ZoneInfo("UTC")
 
@@ -189,100 +314,143 @@ def _make_date(dtstr: str, tzstr: str, fallback_tzstr: str):
     return utc_dt
 
 
-def _normalize_doc(site: Site, rows: list[OrigRow]):
-    def _build(x: OrigRow) -> NormRow:
-        return {
-            "agency": x["agency"],
-            "datetime": _make_date(x["datetime"], x["timezone"], site["timezone"]),
-            "timezone": site["timezone"],
-            "discharge": (
-                _make_decimal_from_str(x["discharge"])
-                if (
-                    ("discharge" in x)
-                    and (x["discharge"] != "")
-                    and (x["discharge"] is not None)
-                )
-                else None
-            ),
-            "temperature": (
-                _make_decimal_from_str(x["temperature"])
-                if (
-                    ("temperature" in x)
-                    and (x["temperature"] != "")
-                    and (x["temperature"] is not None)
-                )
-                else None
-            ),
-            "site_no": x["site_no"],
-        }
+def _get_offset_secs(tzinfo: datetime.tzinfo, local: np.datetime64):
+    naive = cast(datetime.datetime, local.astype("datetime64[s]").astype(object))
+    offset = cast(datetime.timedelta, tzinfo.utcoffset(naive))
+    return int(offset.total_seconds())
 
-    return list(map(_build, rows))
 
-
-def _make_decimal_from_str(val: str):
-    return Decimal(val).quantize(Decimal(".00"))
-
-
-def _get_recent_discharges(rows: list[NormRowDischarge]):
-    rec_rows = list(reversed(rows[:PREDICTION_COUNT]))
-    return list(map(lambda x: float(x["discharge"]), rec_rows))
-
-
-def _get_recent_temps(rows: list[NormRowTemperature]):
-    rec_rows = list(reversed(rows[:PREDICTION_COUNT]))
-    return list(map(lambda x: float(x["temperature"]), rec_rows))
-
-
-def _get_discharge_high_row(rows: list[NormRowDischarge]):
-    if len(rows) == 0:
-        return None
-    outrows = sorted(rows, key=lambda x: x["discharge"], reverse=True)
-    return outrows[0]
+def _get_offsets_by(local: np.ndarray, tzinfo: datetime.tzinfo, unit: str):
+    keys, inverse = np.unique(
+        local.astype("datetime64[%s]" % unit), return_inverse=True
+    )
+    offsets = np.fromiter(
+        map(lambda x: _get_offset_secs(tzinfo, x), keys), np.int64, len(keys)
+    )
+    return (keys, inverse, offsets)
+
+
+def _get_utc_offsets(local: np.ndarray, tzinfo: datetime.tzinfo):
+    """
+    Looks up the UTC offset of every local timestamp.
+
+    Offsets are resolved once per distinct local day. Only days whose
+    offset differs between their first and last hour, which are the DST
+    transition days, are resolved per hour, since offsets only change
+    on the hour.
+    """
+    days, inverse, starts = _get_offsets_by(local, tzinfo, "D")
+    ends = np.fromiter(
+        map(lambda x: _get_offset_secs(tzinfo, x + np.timedelta64(23, "h")), days),
+        np.int64,
+        len(days),
+    )
+    ret = starts[inverse]
+    for day_idx in np.flatnonzero(starts != ends):
+        mask = inverse == day_idx
+        _, hour_inverse, hour_offsets = _get_offsets_by(local[mask], tzinfo, "h")
+        ret[mask] = hour_offsets[hour_inverse]
+    return ret.astype("timedelta64[s]")
+
+
+def _make_dates(dtstrs: list[str], tzstrs: list[str], fallback_tzstr: str):
+    """
+    Converts a column of local timestamp strings and their timezone codes
+    to UTC `datetime64[s]` in bulk. Same results as `_make_date` per row.
+    """
+    try:
+        local = np.array(dtstrs, dtype="datetime64[s]")
+    except ValueError:
+        return np.array(
+            list(
+                map(
+                    lambda x: int(_make_date(x[0], x[1], fallback_tzstr).timestamp()),
+                    zip(dtstrs, tzstrs),
+                )
+            ),
+            dtype=np.int64,
+        ).astype("datetime64[s]")
+    codes = np.array(tzstrs)
+    ret = np.empty(len(local), dtype="datetime64[s]")
+    for code in np.unique(codes):
+        mask = codes == code
+        tzinfo = _get_tz(str(code), fallback_tzstr)
+        ret[mask] = local[mask] - _get_utc_offsets(local[mask], tzinfo)
+    return ret
 
 
-def _get_discharge_low_row(rows: list[NormRowDischarge]):
-    if len(rows) == 0:
-        return None
-    outrows = sorted(rows, key=lambda x: x["discharge"])
-    return outrows[0]
+def _make_vals(strs: list[str]):
+    return rowbatch.from_strs(strs)
 
 
-def _get_temp_high_row(rows: list[NormRowTemperature]):
-    if len(rows) == 0:
-        return None
-    outrows = sorted(rows, key=lambda x: x["temperature"], reverse=True)
-    return outrows[0]
+def normalize_batch(site: Site, rows: Iterable[OrigRow]):
+    """
+    Normalizes parsed rows straight into a `RowBatch`, newest first,
+    converting whole columns at once instead of row by row.
+    """
+    rowlist = list(rows)
+    dtstrs = list(map(lambda x: x["datetime"], rowlist))
+    tzstrs = list(map(lambda x: x["timezone"], rowlist))
+    discharge, discharge_valid = _make_vals(
+        list(map(lambda x: x.get("discharge") or "", rowlist))
+    )
+    temperature, temperature_valid = _make_vals(
+        list(map(lambda x: x.get("temperature") or "", rowlist))
+    )
+    ret: RowBatch = {
+        "datetime": _make_dates(dtstrs, tzstrs, site["timezone"])[::-1],
+        "discharge": discharge[::-1],
+        "discharge_valid": discharge_valid[::-1],
+        "temperature": temperature[::-1],
+        "temperature_valid": temperature_valid[::-1],
+    }
+    return ret
 
 
-def _get_temp_low_row(rows: list[NormRowTemperature]):
-    if len(rows) == 0:
-        return None
-    outrows = sorted(rows, key=lambda x: x["temperature"])
-    return outrows[0]
+def get_recent_vals(batch: RowBatch, param: str):
+    idxs = np.flatnonzero(batch[param + "_valid"])[:PREDICTION_COUNT]
+    return list(map(int, batch[param][idxs[::-1]]))
 
 
-def _get_back_date(curr_dt: datetime.datetime, days: int):
+def get_back_date(curr_dt: datetime.datetime, days: int):
     delta = datetime.timedelta(days=days)
     back_datetime = curr_dt - delta
     back_date = back_datetime.date()
     return back_date
 
 
-def _get_curr_date():
+def get_curr_date():
     return datetime.datetime.now(tz=_get_tz_utc()).replace(microsecond=0)
 
 
-def _build_stats(
+def build_stats(
     site: Site,
     url: str,
-    rows: list[NormRow],
+    batch: RowBatch,
     curr_dt: datetime.datetime,
     back_date: datetime.date,
+    predictions: dict[str, FixedPrediction] | None = None,
 ):
-    if len(rows) == 0:
+    """
+    Builds a site's stats from its readings. `predictions`, keyed by
+    parameter, are used instead of fitting the readings here, such as
+    the ones `predict_batches` fits for many sites at once.
+    """
+    if rowbatch.get_size(batch) == 0:
         return None
-    discharge = _build_stats_discharge(rows) if site["feature_discharge"] else None
-    temp = _build_stats_temp(rows) if site["feature_temperature"] else None
+    if predictions is None:
+        predictions = {}
+    aggs = aggregate.aggregate(batch)[aggregate.WINDOW_ALL]
+    discharge = (
+        _build_stats_discharge(batch, aggs["discharge"], predictions.get("discharge"))
+        if site["feature_discharge"]
+        else None
+    )
+    temp = (
+        _build_stats_temp(batch, aggs["temperature"], predictions.get("temperature"))
+        if site["feature_temperature"]
+        else None
+    )
     ret: Stat = {
         "site_no": site["site_no"],
         "site_name_full": site["name_full"],
@@ -290,7 +458,7 @@ def _build_stats(
         "site_region": site["region"],
         "site_timezone": site["timezone"],
         "data_url": url,
-        "rowcount": len(rows),
+        "rowcount": rowbatch.get_size(batch),
         "fetch_datetime": curr_dt,
         "begin_date": back_date,
         "discharge_recent_value": (
@@ -329,83 +497,363 @@ def _build_stats(
     return ret
 
 
-def _build_stats_discharge(allrows: list[NormRowDischarge]):
-    rows = list(filter(lambda x: x["discharge"] is not None, allrows))
-    high_row = _get_discharge_high_row(rows)
-    low_row = _get_discharge_low_row(rows)
-    if high_row is None or low_row is None:
+def _build_stats_param(
+    batch: RowBatch,
+    agg: ParamAggregate,
+    param: str,
+    prediction: FixedPrediction | None,
+):
+    if agg["count"] == 0:
         return None
-    recent = rows[0]
-    recent_discharges = _get_recent_discharges(rows)
-    prediction = get_prediction_info(recent_discharges, PREDICTION_COUNT)
-    ret: StatDischarge = {
-        "recent_value": recent["discharge"],
-        "recent_datetime": recent["datetime"],
-        "prediction_value": prediction["values"][-1],
+    recent_idx = agg["recent_index"]
+    high_idx = agg["high_index"]
+    low_idx = agg["low_index"]
+    if prediction is None:
+        with metrics.timed("prediction"):
+            prediction = get_prediction_info_fixed(
+                get_recent_vals(batch, param), PREDICTION_COUNT
+            )
+    ret: StatDischarge | StatTemp = {
+        "recent_value": rowbatch.to_decimal(batch[param][recent_idx]),
+        "recent_datetime": rowbatch.to_datetime(batch["datetime"][recent_idx]),
+        "prediction_value": rowbatch.to_decimal(prediction["values"][-1]),
         "prediction_direction": prediction["direction"],
-        "high_value": high_row["discharge"],
-        "low_value": low_row["discharge"],
-        "high_datetime": high_row["datetime"],
-        "low_datetime": low_row["datetime"],
+        "high_value": rowbatch.to_decimal(batch[param][high_idx]),
+        "low_value": rowbatch.to_decimal(batch[param][low_idx]),
+        "high_datetime": rowbatch.to_datetime(batch["datetime"][high_idx]),
+        "low_datetime": rowbatch.to_datetime(batch["datetime"][low_idx]),
     }
     return ret
 
 
-def _build_stats_temp(allrows: list[NormRowTemperature]):
-    rows = list(filter(lambda x: x["temperature"] is not None, allrows))
-    high_row = _get_temp_high_row(rows)
-    low_row = _get_temp_low_row(rows)
-    if high_row is None or low_row is None:
-        return None
-    recent = rows[0]
-    recent_temps = _get_recent_temps(rows)
-    prediction = get_prediction_info(recent_temps, PREDICTION_COUNT)
-    ret: StatTemp = {
-        "recent_value": recent["temperature"],
-        "recent_datetime": recent["datetime"],
-        "prediction_value": prediction["values"][-1],
-        "prediction_direction": prediction["direction"],
-        "high_value": high_row["temperature"],
-        "low_value": low_row["temperature"],
-        "high_datetime": high_row["datetime"],
-        "low_datetime": low_row["datetime"],
-    }
+def _build_stats_discharge(
+    batch: RowBatch, agg: ParamAggregate, prediction: FixedPrediction | None
+):
+    return cast(
+        StatDischarge | None,
+        _build_stats_param(batch, agg, "discharge", prediction),
+    )
+
+
+def _build_stats_temp(
+    batch: RowBatch, agg: ParamAggregate, prediction: FixedPrediction | None
+):
+    return cast(
+        StatTemp | None, _build_stats_param(batch, agg, "temperature", prediction)
+    )
+
+
+def predict_batches(batches: list[RowBatch]):
+    """
+    Fits the recent readings of every parameter of every batch, with
+    windows of equal length fitted together in one vectorized call.
+    Returns the predictions of each batch keyed by parameter.
+    """
+    keys: list[tuple[int, str]] = []
+    for idx in range(len(batches)):
+        for param in rowbatch.PARAMS:
+            keys.append((idx, param))
+    with metrics.timed("prediction") as timer:
+        predicted = get_prediction_infos_fixed(
+            list(map(lambda x: get_recent_vals(batches[x[0]], x[1]), keys)),
+            PREDICTION_COUNT,
+        )
+        timer.rows = len(keys)
+    ret: list[dict[str, FixedPrediction]] = list(map(lambda x: {}, batches))
+    for (idx, param), prediction in zip(keys, predicted):
+        ret[idx][param] = prediction
     return ret
 
 
-def _build_for_site(
+def build_stats_many(
+    items: list[tuple[Site, str, RowBatch]],
+    curr_dt: datetime.datetime,
+    back_date: datetime.date,
+):
+    """
+    Same as `build_stats` for many (site, url, batch) items, with the
+    predictions of all of them fitted by one `predict_batches` call.
+    """
+    predictions = predict_batches(list(map(lambda x: x[2], items)))
+    ret: list[Stat | None] = []
+    for (site, url, batch), prediction in zip(items, predictions):
+        with metrics.timed("stats", site["site_no"]):
+            ret.append(build_stats(site, url, batch, curr_dt, back_date, prediction))
+    return ret
+
+
+def build_for_site(
     site: Site,
     raw: str,
     url: str,
     curr_dt: datetime.datetime,
     begin_date: datetime.date,
 ):
-    clean = _cleanup(raw)
-    if clean is None:
-        return None
-    rawrows = _to_csv(clean)
-    normrows = _normalize_doc(site, rawrows)
-    stats = _build_stats(site, url, normrows, curr_dt, begin_date)
+    batch = normalize_batch(site, parse_rdb(iter_lines(raw)))
+    stats = build_stats(site, url, batch, curr_dt, begin_date)
     return stats
 
 
-def _process_for_site(site: Site):
-    curr_dt = _get_curr_date()
-    begin_date = _get_back_date(curr_dt, 1)
-    fetchres = _fetch(site, begin_date)
-    stats = _build_for_site(
-        site, fetchres["text"], fetchres["url"], curr_dt, begin_date
+def _load_rows(site: Site, rawrows: Iterable[OrigRow]):
+    with metrics.timed("normalize", site["site_no"]) as timer:
+        batch = normalize_batch(site, rawrows)
+        timer.rows = rowbatch.get_size(batch)
+    return batch
+
+
+def _build_for_site_rows(
+    site: Site,
+    rawrows: Iterable[OrigRow],
+    url: str,
+    curr_dt: datetime.datetime,
+    begin_date: datetime.date,
+):
+    batch = _load_rows(site, rawrows)
+    with metrics.timed("stats", site["site_no"]):
+        stats = build_stats(site, url, batch, curr_dt, begin_date)
+    ret: SiteResult = {"stat": stats, "batch": batch}
+    return ret
+
+
+def _get_window_start(site: Site, begin_date: datetime.date):
+    tzinfo = _get_tz(site["timezone"], "UTC")
+    loc_dt = datetime.datetime.combine(begin_date, datetime.time(), tzinfo=tzinfo)
+    return loc_dt.astimezone(_get_tz_utc())
+
+
+def _get_fetch_date(site: Site, begin_date: datetime.date, store_dir: str | None):
+    """
+    Determines the first date to request for a site.
+
+    With a store, data from the date of the newest stored reading onward
+    is requested, so the store catches up on readings missed while
+    nothing was polling, going back at most `MAX_CATCHUP_DAYS` before
+    `begin_date`. Longer gaps are left to `riverdata.backfill`. NWIS
+    takes whole dates, so readings earlier on that date are fetched
+    again and deduplicated on merge.
+    """
+    if store_dir is None:
+        return begin_date
+    newest = observations.get_newest_datetime(store_dir, site["site_no"])
+    if newest is None:
+        return begin_date
+    tzinfo = _get_tz(site["timezone"], "UTC")
+    newest_date = newest.astimezone(tzinfo).date()
+    return max(begin_date - datetime.timedelta(days=MAX_CATCHUP_DAYS), newest_date)
+
+
+def _load_stored(
+    site: Site,
+    rawrows: Iterable[OrigRow],
+    begin_date: datetime.date,
+    store_dir: str,
+):
+    """
+    Merges fetched rows into the store and reads back the site's
+    readings from `begin_date` on.
+    """
+    rowlist = list(rawrows)
+    fetched = _load_rows(site, rowlist)
+    with metrics.timed("store", site["site_no"]) as timer:
+        agencies = list(map(lambda x: x["agency"], rowlist))[::-1]
+        timer.rows = observations.merge_batch(
+            store_dir, site["site_no"], fetched, agencies
+        )
+        rollup.update_times(store_dir, site["site_no"], fetched["datetime"])
+        since = _get_window_start(site, begin_date)
+        return query.read_since(store_dir, site["site_no"], since)
+
+
+def _load_batch(
+    site: Site,
+    rawrows: Iterable[OrigRow],
+    begin_date: datetime.date,
+    store_dir: str | None,
+):
+    with metrics.timed("site", site["site_no"]):
+        if store_dir is None:
+            return _load_rows(site, rawrows)
+        return _load_stored(site, rawrows, begin_date, store_dir)
+
+
+def _fetch_groups(
+    site_nos: str,
+    begin_date: datetime.date,
+    session: requests.Session | None = None,
+    cache: ResponseCache | None = None,
+):
+    """
+    Fetches and parses a request into rows grouped by site. With a
+    cache, a fresh cached response is parsed instead of fetching, and
+    fetched responses are stored as they stream in.
+    """
+    params = _build_url_params(site_nos, begin_date)
+    text = None if cache is None else cache.get(URL, params)
+    if text is not None:
+        with metrics.timed("cache") as timer:
+            groups = group_by_site(parse_rdb(iter_lines(text)))
+            timer.rows = sum(map(len, groups.values()))
+        return groups
+    buf: list[str] = []
+    with fetch_rdb(site_nos, begin_date, session) as resp:
+        with metrics.timed("download") as timer:
+            lines = resp.iter_lines(decode_unicode=True)
+            if cache is not None:
+                lines = _tee_lines(lines, buf)
+            groups = group_by_site(parse_rdb(lines))
+            timer.rows = sum(map(len, groups.values()))
+            timer.bytes = _get_bytes_read(resp)
+    if cache is not None:
+        cache.put(URL, params, "".join(map(lambda x: x + "\n", buf)))
+    return groups
+
+
+def process_batch_rows(
+    sites: list[Site],
+    session: requests.Session | None = None,
+    store_dir: str | None = None,
+    cache: ResponseCache | None = None,
+):
+    """
+    Fetches one batch of sites and returns, per site, its stats along
+    with the readings they were built from, newest first. Sites with no
+    readings get None. Predictions for the whole batch are fitted
+    together by `build_stats_many`.
+    """
+    curr_dt = get_curr_date()
+    begin_date = get_back_date(curr_dt, 1)
+    fetch_date = min(map(lambda x: _get_fetch_date(x, begin_date, store_dir), sites))
+    site_nos = ",".join(map(lambda x: x["site_no"], sites))
+    groups = _fetch_groups(site_nos, fetch_date, session, cache)
+    items: list[tuple[Site, str, RowBatch]] = []
+    for site in sites:
+        if site["site_no"] not in groups and store_dir is None:
+            continue
+        url = build_site_url(site, begin_date)
+        rawrows = groups[site["site_no"]] if site["site_no"] in groups else []
+        items.append((site, url, _load_batch(site, rawrows, begin_date, store_dir)))
+    stats = build_stats_many(items, curr_dt, begin_date)
+    found: dict[str, SiteResult] = {}
+    for (site, _, batch), stat in zip(items, stats):
+        found[site["site_no"]] = {"stat": stat, "batch": batch}
+    ret: list[SiteResult | None] = list(map(lambda x: found.get(x["site_no"]), sites))
+    return ret
+
+
+def process_batch(
+    sites: list[Site],
+    session: requests.Session | None = None,
+    store_dir: str | None = None,
+    cache: ResponseCache | None = None,
+):
+    results = process_batch_rows(sites, session, store_dir, cache)
+    ret: list[Stat | None] = list(
+        map(lambda x: None if x is None else x["stat"], results)
     )
-    return stats
+    return ret
+
+
+def _process_for_site(
+    site: Site,
+    session: requests.Session | None = None,
+    store_dir: str | None = None,
+    cache: ResponseCache | None = None,
+):
+    return process_batch([site], session, store_dir, cache)[0]
 
 
-def process_all_sites():
+def _process_batch_safe(
+    sites: list[Site],
+    session: requests.Session,
+    store_dir: str | None,
+    cache: ResponseCache | None = None,
+):
+    try:
+        with metrics.timed("batch"):
+            return process_batch(sites, session, store_dir, cache)
+    except requests.RequestException as exc:
+        site_nos = ",".join(map(lambda x: x["site_no"], sites))
+        logger.warning("Fetch failed for sites %s: %s", site_nos, exc)
+    return list(map(lambda x: None, sites))
+
+
+def process_all_sites(
+    sites: list[Site] = SITES,
+    concurrency: int = FETCH_CONCURRENCY,
+    batch_size: int = FETCH_BATCH_SIZE,
+    store_dir: str | None = None,
+    cache: ResponseCache | None = None,
+):
+    """
+    Fetches and builds stats for every site.
+
+    Sites are requested in batches of up to `batch_size` site numbers
+    per NWIS request, and batches are fetched by up to `concurrency`
+    worker threads sharing one pooled session, so total wall time
+    tracks the slowest requests rather than the sum of all of them.
+    Sites whose fetch fails after retries are left out of the result.
+
+    With a `store_dir`, fetched readings are merged into the persistent
+    observation store, later runs only request data newer than what is
+    stored, and stats are computed from the store.
+
+    With a `cache`, requests made again within its TTL are served from
+    the cached response instead of the network.
+    """
+    found: Stats = {}
+    batches = chunk_sites(sites, max(1, batch_size))
+    workers = max(1, min(concurrency, len(batches)))
+    with make_session(workers) as session:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(
+                lambda b: _process_batch_safe(b, session, store_dir, cache), batches
+            )
+            for batch, batch_stats in zip(batches, results):
+                for site, stats in zip(batch, batch_stats):
+                    if stats is None:
+                        continue
+                    found[site["site_no"]] = stats
+    ret: Stats = {}
+    for site in sites:
+        if site["site_no"] in found:
+            ret[site["site_no"]] = found[site["site_no"]]
+    return ret
+
+
+def replay_all_sites(cache: ResponseCache, sites: list[Site] = SITES):
+    """
+    Rebuilds stats for every site from cached responses alone, without
+    network access. Each site uses the newest cached response holding
+    its readings, and its stats are computed as of when that response
+    was fetched. Sites with no cached readings are left out.
+    """
+    wanted = set(map(lambda x: x["site_no"], sites))
+    found: dict[str, tuple[datetime.datetime, list[OrigRow]]] = {}
+    entries = sorted(cache.entries(), key=lambda x: x["fetched_at"], reverse=True)
+    for entry in entries:
+        site_nos = set(entry["params"]["site_no"].split(",")) & wanted
+        if len(site_nos - set(found)) == 0:
+            continue
+        text = cache.read(entry)
+        if text is None:
+            continue
+        groups = group_by_site(parse_rdb(iter_lines(text)))
+        fetched_dt = datetime.datetime.fromtimestamp(
+            entry["fetched_at"], tz=_get_tz_utc()
+        ).replace(microsecond=0)
+        for site_no in site_nos:
+            if site_no not in found and site_no in groups:
+                found[site_no] = (fetched_dt, groups[site_no])
     ret: Stats = {}
-    for site in SITES:
-        stats = _process_for_site(site)
-        if stats is None:
+    for site in sites:
+        if site["site_no"] not in found:
             continue
-        ret[site["site_no"]] = stats
+        curr_dt, rawrows = found[site["site_no"]]
+        begin_date = get_back_date(curr_dt, 1)
+        url = build_site_url(site, begin_date)
+        stats = _build_for_site_rows(site, rawrows, url, curr_dt, begin_date)["stat"]
+        if stats is not None:
+            ret[site["site_no"]] = stats
     return ret
 
 
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+from typing import IO, Iterator
+import contextlib
+import os
+import stat
+import tempfile
+
+DEFAULT_MODE = 0o644
+
+
+@contextlib.contextmanager
+def atomic_open(
+    filepath: str, mode: str = "w", encoding: str | None = None
+) -> Iterator[IO]:
+    """
+    Opens a temporary file next to `filepath` for writing and renames it
+    over `filepath` once the block exits cleanly, so readers only ever
+    see the old or the new content, never a partial write. The file
+    keeps the permissions of the file it replaces.
+    """
+    dirname = os.path.dirname(os.path.abspath(filepath))
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+    try:
+        perms = (
+            stat.S_IMODE(os.stat(filepath).st_mode)
+            if os.path.exists(filepath)
+            else DEFAULT_MODE
+        )
+        os.chmod(tmp_path, perms)
+        with os.fdopen(fd, mode, encoding=encoding) as fh:
+            yield fh
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 
 import json
+import typing
 from decimal import Decimal
 import datetime
 
+from riverdata.types import Stat
+
 
 class NewJSONEncoder(json.JSONEncoder):
     def _encode_with_type(self, val: str, dtype: str):
@@ -62,3 +65,57 @@ class NewJsonDecoder(json.JSONDecoder):
         if dtype == "decimal":
             return self._decode_decimal(val)
         return val
+
+
+def _get_field_type(hint: object):
+    args = typing.get_args(hint)
+    hints = args if len(args) > 0 else (hint,)
+    if Decimal in hints:
+        return "decimal"
+    if datetime.datetime in hints:
+        return "datetime"
+    if datetime.date in hints:
+        return "date"
+    return None
+
+
+def _build_field_types(typed_dict: type):
+    hints = typing.get_type_hints(typed_dict)
+    ret: dict[str, str | None] = dict(
+        map(lambda x: (x[0], _get_field_type(x[1])), hints.items())
+    )
+    return ret
+
+
+STAT_FIELD_TYPES = _build_field_types(Stat)
+
+
+class TypedJsonDecoder(NewJsonDecoder):
+    """
+    Decodes the same `||<type>::<value>` wire format as `NewJsonDecoder`,
+    but keeps the C scanner.
+
+    Typed strings are decoded in an `object_hook`, once per object.
+    Fields that `field_types` marks as untyped (None) are skipped without
+    being inspected; any other string value carrying the `||` prefix is
+    decoded.
+    """
+
+    def __init__(
+        self, *args, field_types: dict[str, str | None] | None = None, **kwargs
+    ):
+        kwargs["object_hook"] = self._object_hook
+        json.JSONDecoder.__init__(self, *args, **kwargs)
+        self.field_types = STAT_FIELD_TYPES if field_types is None else field_types
+
+    def _object_hook(self, obj: dict):
+        field_types = self.field_types
+        for key, val in obj.items():
+            if val.__class__ is not str:
+                continue
+            if key in field_types and field_types[key] is None:
+                continue
+            if val[0:2] != "||":
+                continue
+            obj[key] = self._handle_str(val)
+        return obj
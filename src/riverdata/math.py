@@ -1,14 +1,13 @@
 #!/usr/bin/env python3
 
 from typing import TypedDict, Literal
-from decimal import Decimal
-from itertools import count
 import numpy as np
-from sklearn.linear_model import LinearRegression
 
+PREDICTION_COUNT = 8
 
-class Prediction(TypedDict):
-    values: Decimal
+
+class FixedPrediction(TypedDict):
+    values: list[int]
     direction: Literal[-1, 0, 1]
 
 
@@ -36,31 +35,51 @@ class Prediction(TypedDict):
 #     return 0
 
 
+def _fit_lines(windows: np.ndarray):
+    """
+    Fits a least-squares line to every row of a 2-D array of equally
+    sized windows at once, with x running 0..n-1 along each row.
+
+    Uses the closed-form solution, so there is no per-window estimator
+    to build. A window of one value gets a flat line through it.
+    """
+    num = windows.shape[1]
+    x = np.arange(num, dtype=np.float64)
+    x_mean = x.mean()
+    x_dev = x - x_mean
+    denom = np.dot(x_dev, x_dev)
+    y_mean = windows.mean(axis=1)
+    sxy = (windows * x_dev).sum(axis=1)
+    slopes = np.zeros(windows.shape[0]) if denom == 0 else sxy / denom
+    intercepts = y_mean - slopes * x_mean
+    return (slopes, intercepts)
+
+
+def _predict_vals_many(windows: np.ndarray, num_predict_vals: int):
+    """
+    Determine next predicted values for every row of `windows`.
+
+    Uses linear regression.
+    """
+    slopes, intercepts = _fit_lines(windows)
+    num = windows.shape[1]
+    to_predict_x = np.arange(num, num + num_predict_vals, dtype=np.float64)
+    return intercepts[:, None] + slopes[:, None] * to_predict_x[None, :]
+
+
 def _predict_vals(seq: list[float], num_predict_vals: int):
     """
     Determine next predicted values.
 
     Uses linear regression.
-
-    See: https://www.codespeedy.com/predict-next-number-in-a-sequence-with-scikit-learn/
     """
-    data = list(zip(count(), seq))
-    x = np.array(data)[:, 0].reshape(-1, 1)
-    y = np.array(data)[:, 1].reshape(-1, 1)
-    to_predict_x = list(range(len(data), len(data) + num_predict_vals))
-    to_predict_x = np.array(to_predict_x).reshape(-1, 1)
-    regsr = LinearRegression()
-    regsr.fit(x, y)
-    predicted_y = regsr.predict(to_predict_x)
-    ret = list(map(lambda x: float(x[0]), predicted_y))
+    windows = np.array(seq, dtype=np.float64).reshape(1, -1)
+    predicted_y = _predict_vals_many(windows, num_predict_vals)[0]
+    ret = list(map(float, predicted_y))
     return ret
 
 
-def _vals_as_dec(vals: list[float], val_places: int):
-    return list(map(lambda x: round(Decimal(x), val_places), vals))
-
-
-def _get_direction(invals: list[float], outvals: list[float], compare_places: int):
+def get_direction(invals: list[float], outvals: list[float], compare_places: int):
     if len(invals) == 0 or len(outvals) == 0:
         return 0
     last_inval = round(invals[-1], compare_places)
@@ -72,14 +91,63 @@ def _get_direction(invals: list[float], outvals: list[float], compare_places: in
     return 0
 
 
-def get_prediction_info(
-    seq: list[float],
+def _to_fixed_prediction(
+    seq: list[int], outvals: list[float], val_places: int, compare_places: int
+):
+    scale = 10 ** (val_places - compare_places)
+    direction = get_direction(
+        list(map(lambda x: x / scale, seq)),
+        list(map(lambda x: x / scale, outvals)),
+        0,
+    )
+    ret: FixedPrediction = {
+        "values": list(map(round, outvals)),
+        "direction": direction,
+    }
+    return ret
+
+
+def get_prediction_info_fixed(
+    seq: list[int],
     num_predict_vals: int,
     val_places: int = 2,
     compare_places: int = 0,
 ):
+    """
+    Predicts the next `num_predict_vals` values of a sequence of fixed
+    point values, given as integer multiples of 10**-val_places, and
+    whether the last prediction is above or below the last value when
+    both are rounded to `compare_places`. Predicted values are rounded
+    to the same fixed point, half to even, and stay integers.
+    """
     outvals = _predict_vals(seq, num_predict_vals)
-    direction = _get_direction(seq, outvals, compare_places)
-    vals = _vals_as_dec(outvals, val_places)
-    ret: Prediction = {"values": vals, "direction": direction}
+    return _to_fixed_prediction(seq, outvals, val_places, compare_places)
+
+
+def get_prediction_infos_fixed(
+    seqs: list[list[int]],
+    num_predict_vals: int,
+    val_places: int = 2,
+    compare_places: int = 0,
+):
+    """
+    Same as `get_prediction_info_fixed` for many sequences.
+
+    Sequences of equal length are fitted together in one vectorized
+    call, so a refresh of many sites costs one fit per window length.
+    Empty sequences get no values.
+    """
+    groups: dict[int, list[int]] = {}
+    for i, seq in enumerate(seqs):
+        if len(seq) > 0:
+            groups.setdefault(len(seq), []).append(i)
+    ret: list[FixedPrediction] = list(
+        map(lambda x: {"values": [], "direction": 0}, seqs)
+    )
+    for idxs in groups.values():
+        windows = np.array(list(map(lambda x: seqs[x], idxs)), dtype=np.float64)
+        predicted = _predict_vals_many(windows, num_predict_vals)
+        for i, outrow in zip(idxs, predicted):
+            outvals = list(map(float, outrow))
+            ret[i] = _to_fixed_prediction(seqs[i], outvals, val_places, compare_places)
     return ret
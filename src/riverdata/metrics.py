@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+"""
+Per-stage timing and counters for the fetch pipeline.
+
+Stages are wrapped in `timed(stage, site_no)`. While no hook is
+registered it returns a shared no-op context manager, so instrumentation
+costs a function call per stage. With hooks registered, every stage
+emits an `Event` to each hook when it finishes.
+"""
+
+from typing import Callable, TypedDict
+import threading
+import time
+
+
+class Event(TypedDict):
+    stage: str
+    site_no: str | None
+    seconds: float
+    rows: int
+    bytes: int
+    retries: int
+    error: str | None
+
+
+Hook = Callable[[Event], None]
+
+_HOOKS: list[Hook] = []
+
+_HOOKS_LOCK = threading.Lock()
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def __setattr__(self, name: str, value: object):
+        pass
+
+
+class _Timer:
+    __slots__ = ("stage", "site_no", "rows", "bytes", "retries", "_start")
+
+    def __init__(self, stage: str, site_no: str | None):
+        self.stage = stage
+        self.site_no = site_no
+        self.rows = 0
+        self.bytes = 0
+        self.retries = 0
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        event: Event = {
+            "stage": self.stage,
+            "site_no": self.site_no,
+            "seconds": time.perf_counter() - self._start,
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "retries": self.retries,
+            "error": None if exc_type is None else exc_type.__name__,
+        }
+        emit(event)
+        return False
+
+
+_NOOP = _NoopTimer()
+
+
+def add_hook(hook: Hook):
+    with _HOOKS_LOCK:
+        _HOOKS.append(hook)
+    return hook
+
+
+def remove_hook(hook: Hook):
+    with _HOOKS_LOCK:
+        if hook in _HOOKS:
+            _HOOKS.remove(hook)
+    return True
+
+
+def is_enabled():
+    return len(_HOOKS) > 0
+
+
+def emit(event: Event):
+    for hook in tuple(_HOOKS):
+        hook(event)
+
+
+def timed(stage: str, site_no: str | None = None):
+    """
+    Times a pipeline stage. The returned object takes `rows`, `bytes`
+    and `retries` counts, which are reported with the timing.
+    """
+    if not _HOOKS:
+        return _NOOP
+    return _Timer(stage, site_no)
+
+
+class StageTotals(TypedDict):
+    calls: int
+    errors: int
+    seconds: float
+    rows: int
+    bytes: int
+    retries: int
+
+
+def _escape_label(val: str):
+    return val.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Collector:
+    """
+    A hook that accumulates events into per-stage totals and the last
+    duration of every (stage, site), and dumps them in the Prometheus
+    text exposition format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages: dict[str, StageTotals] = {}
+        self.site_seconds: dict[tuple[str, str], float] = {}
+
+    def __call__(self, event: Event):
+        with self._lock:
+            if event["stage"] not in self.stages:
+                self.stages[event["stage"]] = {
+                    "calls": 0,
+                    "errors": 0,
+                    "seconds": 0.0,
+                    "rows": 0,
+                    "bytes": 0,
+                    "retries": 0,
+                }
+            totals = self.stages[event["stage"]]
+            totals["calls"] += 1
+            totals["errors"] += 0 if event["error"] is None else 1
+            totals["seconds"] += event["seconds"]
+            totals["rows"] += event["rows"]
+            totals["bytes"] += event["bytes"]
+            totals["retries"] += event["retries"]
+            if event["site_no"] is not None:
+                key = (event["stage"], event["site_no"])
+                self.site_seconds[key] = event["seconds"]
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.site_seconds = {}
+
+    def to_prometheus(self, prefix: str = "riverdata"):
+        with self._lock:
+            stages = dict(self.stages)
+            site_seconds = dict(self.site_seconds)
+        lines: list[str] = []
+        counters = [
+            ("calls", "Stage invocations."),
+            ("errors", "Stage invocations that raised."),
+            ("seconds", "Time spent in the stage."),
+            ("rows", "Rows handled by the stage."),
+            ("bytes", "Bytes downloaded by the stage."),
+            ("retries", "HTTP retries made by the stage."),
+        ]
+        for field, help_text in counters:
+            name = "%s_stage_%s_total" % (prefix, field)
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s counter" % name)
+            for stage, totals in sorted(stages.items()):
+                lines.append(
+                    '%s{stage="%s"} %s' % (name, _escape_label(stage), totals[field])
+                )
+        name = "%s_site_last_seconds" % prefix
+        lines.append("# HELP %s Duration of the last run of a stage for a site." % name)
+        lines.append("# TYPE %s gauge" % name)
+        for (stage, site_no), seconds in sorted(site_seconds.items()):
+            lines.append(
+                '%s{stage="%s",site="%s"} %s'
+                % (name, _escape_label(stage), _escape_label(site_no), seconds)
+            )
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+"""
+Persistent per-site observation store.
+
+Observations are kept under `<store_dir>/<site_no>/` in one tab
+separated file per UTC month (`YYYY-MM.tsv`), sorted by timestamp.
+Each line holds the UTC timestamp, agency, discharge and temperature of
+one reading, with empty fields for missing values.
+"""
+
+import datetime
+import os
+
+import numpy as np
+
+from riverdata.fileio import atomic_open
+from riverdata.rowbatch import PLACES, SCALE, RowBatch
+
+PARTITION_EXT = ".tsv"
+
+TAIL_CHUNK = 4096
+
+
+def get_site_dir(store_dir: str, site_no: str):
+    return os.path.join(store_dir, site_no)
+
+
+def get_partition_name(dt: datetime.datetime):
+    return dt.strftime("%Y-%m") + PARTITION_EXT
+
+
+def get_partition_path(store_dir: str, site_no: str, name: str):
+    return os.path.join(get_site_dir(store_dir, site_no), name)
+
+
+def list_partitions(store_dir: str, site_no: str):
+    site_dir = get_site_dir(store_dir, site_no)
+    if not os.path.isdir(site_dir):
+        return []
+    names = filter(lambda x: x.endswith(PARTITION_EXT), os.listdir(site_dir))
+    return sorted(names)
+
+
+def _read_last_line(path: str):
+    with open(path, "rb") as fh:
+        end = fh.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            start = max(0, pos - TAIL_CHUNK)
+            fh.seek(start)
+            lines = fh.read(end - start).rstrip(b"\n").split(b"\n")
+            if len(lines) > 1 or start == 0:
+                return lines[-1].decode("utf-8")
+            pos = start
+    return ""
+
+
+def get_newest_datetime(store_dir: str, site_no: str):
+    """
+    Returns the timestamp of the newest stored reading for a site, or
+    None if nothing has been stored yet. Only the end of the last
+    partition is read.
+    """
+    names = list_partitions(store_dir, site_no)
+    if len(names) == 0:
+        return None
+    line = _read_last_line(get_partition_path(store_dir, site_no, names[-1]))
+    if line == "":
+        return None
+    return datetime.datetime.fromisoformat(line[: line.index("\t")])
+
+
+def _format_fixed(val: int):
+    whole, frac = divmod(abs(val), SCALE)
+    return "%s%d.%0*d" % ("-" if val < 0 else "", whole, PLACES, frac)
+
+
+def _format_column(vals: np.ndarray, valid: np.ndarray):
+    return list(
+        map(
+            lambda x: _format_fixed(x[0]) if x[1] else "",
+            zip(vals.tolist(), valid.tolist()),
+        )
+    )
+
+
+def _read_lines(path: str):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as fh:
+        lines = fh.read().splitlines()
+    return dict(map(lambda x: (x[: x.index("\t")], x), lines))
+
+
+def merge_batch(store_dir: str, site_no: str, batch: RowBatch, agencies: list[str]):
+    """
+    Merges the readings in a `RowBatch` into the store, with the agency
+    of each reading in `agencies`.
+
+    Readings are deduplicated on their timestamp, and a reading that is
+    already stored is replaced by the incoming one so that revised
+    provisional values win. Lines are formatted from the columns and
+    merged as text, and only the month partitions the readings fall
+    into are rewritten. Returns the number of readings that were not
+    stored before.
+    """
+    dtstrs = np.datetime_as_string(batch["datetime"].astype("datetime64[s]"))
+    discharge = _format_column(batch["discharge"], batch["discharge_valid"])
+    temperature = _format_column(batch["temperature"], batch["temperature_valid"])
+    months: dict[str, dict[str, str]] = {}
+    for dtstr, agency, dval, tval in zip(
+        dtstrs.tolist(), agencies, discharge, temperature
+    ):
+        key = dtstr + "+00:00"
+        line = "\t".join([key, agency, dval, tval])
+        months.setdefault(key[:7] + PARTITION_EXT, {})[key] = line
+    added = 0
+    for name, newlines in months.items():
+        path = get_partition_path(store_dir, site_no, name)
+        merged = _read_lines(path)
+        changed = dict(filter(lambda x: merged.get(x[0]) != x[1], newlines.items()))
+        if len(changed) == 0:
+            continue
+        size = len(merged)
+        merged.update(changed)
+        added += len(merged) - size
+        with atomic_open(path, "w", encoding="utf-8") as fh:
+            for key in sorted(merged):
+                fh.write(merged[key])
+                fh.write("\n")
+    return added
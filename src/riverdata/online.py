@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+"""
+Streaming predictions from sliding windows of readings.
+
+The stats pipeline fits a line to a site's last `PREDICTION_COUNT`
+readings from scratch on every refresh. In continuous ingestion the fit
+is instead kept current: a window holds the sums n, Σx, Σy, Σxy and
+Σx² of its readings, adding a reading's terms when it arrives and
+subtracting them when it leaves, so a new prediction costs the same
+however large the window is. Values are fixed point integers and x is
+a reading counter or whole seconds, so the sums are exact integers and
+do not drift however long the window slides.
+
+A window holds either the last `size` readings, with x counting
+readings as in the batch fit, or the readings of the last `seconds`,
+with x in seconds so irregularly reported readings are placed by time.
+"""
+
+from collections import deque
+from fractions import Fraction
+
+import numpy as np
+
+from riverdata import rowbatch
+from riverdata.math import PREDICTION_COUNT, FixedPrediction, get_direction
+from riverdata.rowbatch import PARAMS, SCALE, RowBatch
+
+HORIZON_SECONDS = PREDICTION_COUNT * 15 * 60
+
+
+def _check_window(size: int | None, seconds: int | None):
+    if (size is None) == (seconds is None):
+        raise ValueError("Exactly one of size and seconds must be given")
+    if (size if seconds is None else seconds) <= 0:
+        raise ValueError("Window must be positive")
+    return True
+
+
+class RollingFit:
+    """
+    Least-squares line over a sliding window of (seconds, value)
+    readings, given oldest first. Exactly one of `size` and `seconds`
+    sets the window.
+    """
+
+    def __init__(self, size: int | None = PREDICTION_COUNT, seconds: int | None = None):
+        _check_window(size, seconds)
+        self.size = size
+        self.seconds = seconds
+        self.newest: int | None = None
+        self.last_value: int | None = None
+        self._seen = 0
+        self._window: deque[tuple[int, int]] = deque()
+        self._n = 0
+        self._sx = 0
+        self._sy = 0
+        self._sxy = 0
+        self._sxx = 0
+
+    def _push(self, x: int, y: int):
+        self._window.append((x, y))
+        self._n += 1
+        self._sx += x
+        self._sy += y
+        self._sxy += x * y
+        self._sxx += x * x
+        return True
+
+    def _pop(self):
+        x, y = self._window.popleft()
+        self._n -= 1
+        self._sx -= x
+        self._sy -= y
+        self._sxy -= x * y
+        self._sxx -= x * x
+        return True
+
+    def __len__(self):
+        return self._n
+
+    def add(self, secs: int, val: int):
+        """
+        Adds a reading taken at `secs` since the epoch. Readings not
+        newer than the newest one already added are ignored, and False
+        is returned for them.
+        """
+        if self.newest is not None and secs <= self.newest:
+            return False
+        self.newest = secs
+        self.last_value = val
+        self._push(self._seen if self.seconds is None else secs, val)
+        self._seen += 1
+        if self.seconds is None:
+            while self._n > self.size:
+                self._pop()
+        else:
+            while self._window[0][0] <= secs - self.seconds:
+                self._pop()
+        return True
+
+    def predict(self, steps: int):
+        """
+        Returns the fitted value `steps` readings, or seconds for a time
+        window, after the newest reading, rounded half to even, or None
+        if the window is empty. A window of one reading, or of readings
+        at a single x, gives a flat line through their mean.
+        """
+        if self._n == 0:
+            return None
+        denom = self._n * self._sxx - self._sx * self._sx
+        if denom == 0:
+            return round(Fraction(self._sy, self._n))
+        x = self._window[-1][0] + steps
+        num = self._sy * denom + (self._n * self._sxy - self._sx * self._sy) * (
+            self._n * x - self._sx
+        )
+        return round(Fraction(num, self._n * denom))
+
+    def get_prediction(self, steps: int):
+        """
+        Same as `get_prediction_info_fixed` on the window, for one
+        prediction `steps` ahead. Returns None if the window is empty.
+        """
+        val = self.predict(steps)
+        if val is None or self.last_value is None:
+            return None
+        ret: FixedPrediction = {
+            "values": [val],
+            "direction": get_direction([self.last_value / SCALE], [val / SCALE], 0),
+        }
+        return ret
+
+
+class OnlinePredictor:
+    """
+    Keeps a `RollingFit` per site and parameter, where parameters are
+    the `RowBatch` columns. `horizon` is how far ahead predictions are
+    made, in readings or seconds to match the window, and defaults to
+    the reach of the batch prediction.
+    """
+
+    def __init__(
+        self,
+        size: int | None = PREDICTION_COUNT,
+        seconds: int | None = None,
+        horizon: int | None = None,
+    ):
+        _check_window(size, seconds)
+        self.size = size
+        self.seconds = seconds
+        if horizon is None:
+            horizon = PREDICTION_COUNT if seconds is None else HORIZON_SECONDS
+        self.horizon = horizon
+        self.fits: dict[tuple[str, str], RollingFit] = {}
+
+    def _get_fit(self, site_no: str, param: str):
+        key = (site_no, param)
+        if key not in self.fits:
+            self.fits[key] = RollingFit(self.size, self.seconds)
+        return self.fits[key]
+
+    def add(self, site_no: str, param: str, secs: int, val: int):
+        return self._get_fit(site_no, param).add(secs, val)
+
+    def add_batch(self, site_no: str, batch: RowBatch):
+        """
+        Adds the valid readings of a `RowBatch` that are newer than the
+        ones already added, such as a range read from the observation
+        store to warm the windows up. Returns the number added.
+        """
+        times = batch["datetime"].astype("datetime64[s]").astype(np.int64)
+        ret = 0
+        for param in PARAMS:
+            fit = self._get_fit(site_no, param)
+            mask = batch[param + "_valid"]
+            if fit.newest is not None:
+                mask = mask & (times > fit.newest)
+            for idx in np.flatnonzero(mask)[::-1]:
+                if fit.add(int(times[idx]), int(batch[param][idx])):
+                    ret += 1
+        return ret
+
+    def get_prediction(self, site_no: str, param: str):
+        """
+        Returns the current prediction for a site's parameter, or None
+        if no readings of it have been added.
+        """
+        fit = self.fits.get((site_no, param))
+        return None if fit is None else fit.get_prediction(self.horizon)
+
+    def get_prediction_value(self, site_no: str, param: str):
+        prediction = self.get_prediction(site_no, param)
+        if prediction is None:
+            return None
+        return rowbatch.to_decimal(prediction["values"][-1])
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+"""
+Time-range queries over the observation store.
+
+Partitions are UTC months, so a query works out the partition names its
+range covers and reads only those. Each partition is parsed once into
+sorted timestamp and value arrays, cached until the file changes, and
+searched with `np.searchsorted`. Query time depends on the length of
+the range, not on how much history a site has.
+"""
+
+from collections import OrderedDict
+from decimal import Decimal
+import datetime
+import os
+
+import numpy as np
+
+from riverdata import observations, rowbatch
+from riverdata.rowbatch import RowBatch
+
+MAX_CACHED_PARTITIONS = 256
+
+UTC = datetime.timezone.utc
+
+
+def _to_datetime64(dt: datetime.datetime):
+    return np.datetime64(int(dt.astimezone(UTC).timestamp()), "s")
+
+
+def _add_months(dt: datetime.datetime, months: int):
+    index = dt.year * 12 + dt.month - 1 + months
+    return datetime.datetime(index // 12, index % 12 + 1, 1, tzinfo=UTC)
+
+
+def iter_partition_names(start: datetime.datetime, end: datetime.datetime):
+    month = _add_months(start.astimezone(UTC), 0)
+    last = end.astimezone(UTC)
+    while month <= last:
+        yield observations.get_partition_name(month)
+        month = _add_months(month, 1)
+
+
+def read_partition(path: str):
+    """
+    Parses a partition into a `RowBatch`, oldest first.
+    """
+    with open(path, "r", encoding="utf-8") as fh:
+        lines = fh.read().splitlines()
+    parts = list(map(lambda x: x.split("\t"), lines))
+    dtstrs = list(map(lambda x: x[0][:19], parts))
+    discharge, discharge_valid = rowbatch.from_strs(list(map(lambda x: x[2], parts)))
+    temperature, temperature_valid = rowbatch.from_strs(
+        list(map(lambda x: x[3], parts))
+    )
+    ret: RowBatch = {
+        "datetime": np.array(dtstrs, dtype="datetime64[s]"),
+        "discharge": discharge,
+        "discharge_valid": discharge_valid,
+        "temperature": temperature,
+        "temperature_valid": temperature_valid,
+    }
+    return ret
+
+
+def read_since(store_dir: str, site_no: str, since: datetime.datetime):
+    """
+    Returns a site's stored readings at or after `since` as a
+    `RowBatch`, newest first.
+    """
+    first = observations.get_partition_name(since.astimezone(UTC))
+    lower = _to_datetime64(since)
+    parts: list[RowBatch] = []
+    for name in observations.list_partitions(store_dir, site_no):
+        if name < first:
+            continue
+        batch = read_partition(
+            observations.get_partition_path(store_dir, site_no, name)
+        )
+        start = np.searchsorted(batch["datetime"], lower, side="left")
+        parts.append(_reverse(_slice(batch, start, rowbatch.get_size(batch))))
+    return rowbatch.concat(parts[::-1])
+
+
+def _slice(batch: RowBatch, start: int, stop: int):
+    ret: RowBatch = {
+        "datetime": batch["datetime"][start:stop],
+        "discharge": batch["discharge"][start:stop],
+        "discharge_valid": batch["discharge_valid"][start:stop],
+        "temperature": batch["temperature"][start:stop],
+        "temperature_valid": batch["temperature_valid"][start:stop],
+    }
+    return ret
+
+
+def _reverse(batch: RowBatch):
+    ret: RowBatch = {
+        "datetime": batch["datetime"][::-1],
+        "discharge": batch["discharge"][::-1],
+        "discharge_valid": batch["discharge_valid"][::-1],
+        "temperature": batch["temperature"][::-1],
+        "temperature_valid": batch["temperature_valid"][::-1],
+    }
+    return ret
+
+
+class ObservationQuery:
+    """
+    Answers range and point queries for the store at `store_dir`,
+    keeping up to `max_partitions` parsed partitions in memory.
+    """
+
+    def __init__(self, store_dir: str, max_partitions: int = MAX_CACHED_PARTITIONS):
+        self.store_dir = store_dir
+        self.max_partitions = max_partitions
+        self._cache: OrderedDict[str, tuple[tuple[int, int], RowBatch]] = OrderedDict()
+
+    def _get_partition(self, site_no: str, name: str):
+        path = observations.get_partition_path(self.store_dir, site_no, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        version = (st.st_mtime_ns, st.st_size)
+        cached = self._cache.get(path)
+        if cached is not None and cached[0] == version:
+            self._cache.move_to_end(path)
+            return cached[1]
+        batch = read_partition(path)
+        self._cache[path] = (version, batch)
+        self._cache.move_to_end(path)
+        while len(self._cache) > self.max_partitions:
+            self._cache.popitem(last=False)
+        return batch
+
+    def read_range(
+        self, site_no: str, start: datetime.datetime, end: datetime.datetime
+    ):
+        """
+        Returns a site's readings from `start` to `end`, inclusive, as a
+        `RowBatch`, newest first.
+        """
+        lower = _to_datetime64(start)
+        upper = _to_datetime64(end)
+        parts: list[RowBatch] = []
+        for name in iter_partition_names(start, end):
+            batch = self._get_partition(site_no, name)
+            if batch is None:
+                continue
+            first = np.searchsorted(batch["datetime"], lower, side="left")
+            last = np.searchsorted(batch["datetime"], upper, side="right")
+            if last > first:
+                parts.append(_reverse(_slice(batch, first, last)))
+        return rowbatch.concat(parts[::-1])
+
+    def value_at(
+        self,
+        site_no: str,
+        dt: datetime.datetime,
+        param: str = "discharge",
+        lookback_months: int = 1,
+    ) -> tuple[datetime.datetime, Decimal] | None:
+        """
+        Returns the time and value of the latest valid reading of
+        `param` at or before `dt`, looking back through at most
+        `lookback_months` earlier partitions, or None if there is none.
+        """
+        point = _to_datetime64(dt)
+        month = dt.astimezone(UTC)
+        for _ in range(lookback_months + 1):
+            batch = self._get_partition(site_no, observations.get_partition_name(month))
+            month = _add_months(month, -1)
+            if batch is None:
+                continue
+            stop = np.searchsorted(batch["datetime"], point, side="right")
+            valid = np.flatnonzero(batch[param + "_valid"][:stop])
+            if len(valid) == 0:
+                continue
+            idx = valid[-1]
+            return (
+                rowbatch.to_datetime(batch["datetime"][idx]),
+                rowbatch.to_decimal(batch[param][idx]),
+            )
+        return None
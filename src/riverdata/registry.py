@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import functools
+import json
+import os
+
+from riverdata.types import Site, Park
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+SITES_FILEPATH = os.path.join(DATA_DIR, "sites.json")
+
+PARKS_FILEPATH = os.path.join(DATA_DIR, "parks.json")
+
+FEATURES = ("discharge", "temperature")
+
+
+class Registry:
+    """
+    Sites and parks with lookup indexes built once at load time, so
+    queries only touch the entries they return.
+    """
+
+    def __init__(self, sites: list[Site], parks: list[Park]):
+        self.sites = sites
+        self.parks = parks
+        self._sites_by_no: dict[str, Site] = {}
+        self._sites_by_region: dict[str, list[Site]] = {}
+        self._sites_by_feature: dict[str, list[Site]] = dict(
+            map(lambda x: (x, []), FEATURES)
+        )
+        self._parks_by_site: dict[str, list[Park]] = {}
+        self._parks_by_region: dict[str, list[Park]] = {}
+        for site in sites:
+            self._sites_by_no[site["site_no"]] = site
+            self._sites_by_region.setdefault(site["region"], []).append(site)
+            for feature in FEATURES:
+                if site["feature_" + feature]:
+                    self._sites_by_feature[feature].append(site)
+        for park in parks:
+            self._parks_by_region.setdefault(park["region"], []).append(park)
+            site_nos = {park["site_no_discharge"], park["site_no_temperature"]}
+            for site_no in site_nos:
+                self._parks_by_site.setdefault(site_no, []).append(park)
+
+    def get_site(self, site_no: str):
+        return self._sites_by_no.get(site_no)
+
+    def get_sites_in_region(self, region: str):
+        return self._sites_by_region.get(region, [])
+
+    def get_sites_with_feature(self, feature: str):
+        return self._sites_by_feature.get(feature, [])
+
+    def get_parks_for_site(self, site_no: str):
+        return self._parks_by_site.get(site_no, [])
+
+    def get_parks_in_region(self, region: str):
+        return self._parks_by_region.get(region, [])
+
+    def get_regions(self):
+        return sorted(set(self._sites_by_region) | set(self._parks_by_region))
+
+
+def get_park_site_nos(parks: list[Park]):
+    """
+    Returns the site numbers the given parks read stats from.
+    """
+    ret: set[str] = set()
+    for park in parks:
+        ret.add(park["site_no_discharge"])
+        ret.add(park["site_no_temperature"])
+    return ret
+
+
+def _read_json(filepath: str):
+    with open(filepath, "r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def load_registry(
+    sites_filepath: str = SITES_FILEPATH, parks_filepath: str = PARKS_FILEPATH
+):
+    sites: list[Site] = _read_json(sites_filepath)
+    parks: list[Park] = _read_json(parks_filepath)
+    return Registry(sites, parks)
+
+
+@functools.lru_cache(maxsize=None)
+def get_registry():
+    """
+    Returns the registry of the bundled data files, loaded once.
+    """
+    return load_registry()
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+
+"""
+Hourly and daily rollups of stored observations.
+
+Every UTC hour and day with readings is summarized per parameter as
+count, min, max, mean and last value. Hourly rollups are kept per month
+under `<store_dir>/<site_no>/rollup-hour/YYYY-MM.tsv` and daily rollups
+per year under `rollup-day/YYYY.tsv`, one bucket per line with the sum
+stored in place of the mean so that buckets compose exactly.
+
+`update_times` recomputes only the buckets that ingested readings fall
+into: hours from the stored readings, then days from their hourly
+rollups.
+"""
+
+from typing import TypedDict, cast
+import datetime
+import os
+
+import numpy as np
+
+from riverdata import observations, query
+from riverdata.fileio import atomic_open
+from riverdata.rowbatch import PARAMS, SCALE, RowBatch
+
+HOUR = 3600
+
+DAY = 24 * HOUR
+
+LEVELS: dict[str, int] = {"hour": HOUR, "day": DAY}
+
+FIELDS = ("count", "min", "max", "mean", "last")
+
+MAX_CHART_POINTS = 500
+
+
+class Rollup(TypedDict):
+    """
+    Buckets of one rollup level, oldest first. `start` holds the UTC
+    start of each bucket. Values are floats in the units of the readings,
+    for charting. Buckets without valid readings of a parameter have a
+    zero count and NaN values for it.
+    """
+
+    start: np.ndarray
+    discharge_count: np.ndarray
+    discharge_min: np.ndarray
+    discharge_max: np.ndarray
+    discharge_mean: np.ndarray
+    discharge_last: np.ndarray
+    temperature_count: np.ndarray
+    temperature_min: np.ndarray
+    temperature_max: np.ndarray
+    temperature_mean: np.ndarray
+    temperature_last: np.ndarray
+
+
+def _get_rollup_path(store_dir: str, site_no: str, level: str, name: str):
+    return os.path.join(
+        observations.get_site_dir(store_dir, site_no),
+        "rollup-" + level,
+        name + observations.PARTITION_EXT,
+    )
+
+
+def _get_secs(times: np.ndarray):
+    return times.astype("datetime64[s]").astype(np.int64)
+
+
+def _build_rollup(starts: np.ndarray, cols: dict[str, np.ndarray]):
+    doc = dict(cols)
+    doc["start"] = starts.astype("datetime64[s]")
+    return cast(Rollup, doc)
+
+
+def _map_rollup(rollup: Rollup, func):
+    return cast(Rollup, dict(map(lambda x: (x[0], func(x[1])), rollup.items())))
+
+
+def _empty_cols(size: int):
+    ret: dict[str, np.ndarray] = {}
+    for param in PARAMS:
+        ret[param + "_count"] = np.zeros(size, np.int64)
+        for field in FIELDS[1:]:
+            ret[param + "_" + field] = np.full(size, np.nan)
+    return ret
+
+
+def _reduce(
+    starts: np.ndarray,
+    keys: np.ndarray,
+    counts: np.ndarray,
+    mins: np.ndarray,
+    maxs: np.ndarray,
+    sums: np.ndarray,
+    lasts: np.ndarray,
+):
+    """
+    Reduces sorted groups of partial aggregates, keyed by bucket start,
+    into the buckets at `starts`.
+    """
+    size = len(starts)
+    count = np.zeros(size, np.int64)
+    low = np.full(size, np.nan)
+    high = np.full(size, np.nan)
+    mean = np.full(size, np.nan)
+    last = np.full(size, np.nan)
+    if len(keys) > 0:
+        uniq, first = np.unique(keys, return_index=True)
+        ends = np.append(first[1:], len(keys))
+        pos = np.searchsorted(starts, uniq)
+        count[pos] = np.add.reduceat(counts, first)
+        low[pos] = np.minimum.reduceat(mins, first)
+        high[pos] = np.maximum.reduceat(maxs, first)
+        mean[pos] = np.add.reduceat(sums, first) / count[pos]
+        last[pos] = lasts[ends - 1]
+    return (count, low, high, mean, last)
+
+
+def aggregate_batch(batch: RowBatch, size: int):
+    """
+    Rolls readings up into buckets of `size` seconds. The batch must be
+    oldest first.
+    """
+    keys = _get_secs(batch["datetime"]) // size * size
+    starts = np.unique(keys)
+    cols: dict[str, np.ndarray] = {}
+    for param in PARAMS:
+        valid = batch[param + "_valid"]
+        vals = batch[param][valid]
+        ones = np.ones(len(vals), np.int64)
+        reduced = _reduce(starts, keys[valid], ones, vals, vals, vals, vals)
+        for field, col in zip(FIELDS, reduced):
+            cols[param + "_" + field] = col if field == "count" else col / SCALE
+    return _build_rollup(starts, cols)
+
+
+def compose(rollup: Rollup, size: int):
+    """
+    Rolls buckets up into larger buckets of `size` seconds.
+    """
+    keys = _get_secs(rollup["start"]) // size * size
+    starts = np.unique(keys)
+    cols: dict[str, np.ndarray] = {}
+    for param in PARAMS:
+        count = rollup[param + "_count"]
+        valid = count > 0
+        reduced = _reduce(
+            starts,
+            keys[valid],
+            count[valid],
+            rollup[param + "_min"][valid],
+            rollup[param + "_max"][valid],
+            (rollup[param + "_mean"] * count)[valid],
+            rollup[param + "_last"][valid],
+        )
+        for field, col in zip(FIELDS, reduced):
+            cols[param + "_" + field] = col
+    return _build_rollup(starts, cols)
+
+
+def _format_val(val: float):
+    return "" if np.isnan(val) else "%.2f" % val
+
+
+def _format_lines(rollup: Rollup):
+    """
+    Formats buckets as lines keyed by their start in epoch seconds.
+    """
+    ret: dict[int, str] = {}
+    starts = _get_secs(rollup["start"])
+    for i, start in enumerate(starts):
+        fields = [
+            datetime.datetime.fromtimestamp(
+                int(start), datetime.timezone.utc
+            ).isoformat()
+        ]
+        for param in PARAMS:
+            count = int(rollup[param + "_count"][i])
+            fields.append(str(count))
+            fields.append(_format_val(rollup[param + "_min"][i]))
+            fields.append(_format_val(rollup[param + "_max"][i]))
+            fields.append(_format_val(rollup[param + "_mean"][i] * count))
+            fields.append(_format_val(rollup[param + "_last"][i]))
+        ret[int(start)] = "\t".join(fields)
+    return ret
+
+
+def _read_lines(path: str):
+    ret: dict[int, str] = {}
+    if not os.path.exists(path):
+        return ret
+    with open(path, "r", encoding="utf-8") as fh:
+        for line in fh:
+            line = line.rstrip("\n")
+            start = datetime.datetime.fromisoformat(line.split("\t", 1)[0])
+            ret[int(start.timestamp())] = line
+    return ret
+
+
+def _parse_floats(strs: list[str]):
+    return np.fromiter(
+        map(lambda x: float(x) if x != "" else np.nan, strs), np.float64, len(strs)
+    )
+
+
+def _parse_lines(lines: list[str]):
+    parts = list(map(lambda x: x.split("\t"), lines))
+    starts = np.array(list(map(lambda x: x[0][:19], parts)), dtype="datetime64[s]")
+    cols: dict[str, np.ndarray] = {}
+    for i, param in enumerate(PARAMS):
+        col = 1 + i * len(FIELDS)
+        count = np.fromiter(map(lambda x: int(x[col]), parts), np.int64, len(parts))
+        total = _parse_floats(list(map(lambda x: x[col + 3], parts)))
+        cols[param + "_count"] = count
+        cols[param + "_min"] = _parse_floats(list(map(lambda x: x[col + 1], parts)))
+        cols[param + "_max"] = _parse_floats(list(map(lambda x: x[col + 2], parts)))
+        cols[param + "_mean"] = np.where(
+            count > 0, total / np.maximum(count, 1), np.nan
+        )
+        cols[param + "_last"] = _parse_floats(list(map(lambda x: x[col + 4], parts)))
+    return _build_rollup(starts, cols)
+
+
+def _read_rollup_partition(path: str):
+    lines = _read_lines(path)
+    return _parse_lines(list(map(lambda x: lines[x], sorted(lines))))
+
+
+def _replace_buckets(path: str, touched: np.ndarray, fresh: Rollup):
+    """
+    Replaces the buckets at `touched` in a rollup partition with the
+    freshly computed ones, dropping touched buckets that are now empty.
+    """
+    lines = _read_lines(path)
+    for start in touched:
+        lines.pop(int(start), None)
+    lines.update(_format_lines(fresh))
+    if len(lines) == 0:
+        if os.path.exists(path):
+            os.unlink(path)
+        return True
+    with atomic_open(path, "w", encoding="utf-8") as fh:
+        for start in sorted(lines):
+            fh.write(lines[start])
+            fh.write("\n")
+    return True
+
+
+def _mask_batch(batch: RowBatch, mask: np.ndarray):
+    ret: RowBatch = {
+        "datetime": batch["datetime"][mask],
+        "discharge": batch["discharge"][mask],
+        "discharge_valid": batch["discharge_valid"][mask],
+        "temperature": batch["temperature"][mask],
+        "temperature_valid": batch["temperature_valid"][mask],
+    }
+    return ret
+
+
+def _mask_rollup(rollup: Rollup, mask: np.ndarray):
+    return _map_rollup(rollup, lambda x: x[mask])
+
+
+def _group_by_name(secs: np.ndarray, unit: str):
+    names = np.datetime_as_string(secs.astype("datetime64[s]").astype(unit))
+    ret: dict[str, np.ndarray] = {}
+    for name in np.unique(names):
+        ret[str(name)] = secs[names == name]
+    return ret
+
+
+def _update_hours(store_dir: str, site_no: str, hours: np.ndarray):
+    for name, month_hours in _group_by_name(hours, "datetime64[M]").items():
+        path = observations.get_partition_path(
+            store_dir, site_no, name + observations.PARTITION_EXT
+        )
+        if not os.path.exists(path):
+            continue
+        batch = query.read_partition(path)
+        keys = _get_secs(batch["datetime"]) // HOUR * HOUR
+        fresh = aggregate_batch(_mask_batch(batch, np.isin(keys, month_hours)), HOUR)
+        _replace_buckets(
+            _get_rollup_path(store_dir, site_no, "hour", name), month_hours, fresh
+        )
+    days = np.unique(hours // DAY * DAY)
+    for name, month_days in _group_by_name(days, "datetime64[M]").items():
+        hourly = _read_rollup_partition(
+            _get_rollup_path(store_dir, site_no, "hour", name)
+        )
+        keys = _get_secs(hourly["start"]) // DAY * DAY
+        fresh = compose(_mask_rollup(hourly, np.isin(keys, month_days)), DAY)
+        _replace_buckets(
+            _get_rollup_path(store_dir, site_no, "day", name[:4]), month_days, fresh
+        )
+    return len(hours)
+
+
+def update_times(store_dir: str, site_no: str, times: np.ndarray):
+    """
+    Recomputes the hourly and daily buckets the given reading times fall
+    into from the stored readings. `times` is a `datetime64` array, such
+    as the `datetime` column of a `RowBatch`. Call after merging the
+    readings into the store. Returns the number of hours recomputed.
+    """
+    if len(times) == 0:
+        return 0
+    secs = _get_secs(times)
+    return _update_hours(store_dir, site_no, np.unique(secs // HOUR * HOUR))
+
+
+def rebuild(store_dir: str, site_no: str):
+    """
+    Recomputes every rollup of a site from all of its stored readings.
+    """
+    total = 0
+    for name in observations.list_partitions(store_dir, site_no):
+        path = observations.get_partition_path(store_dir, site_no, name)
+        secs = _get_secs(query.read_partition(path)["datetime"])
+        total += _update_hours(store_dir, site_no, np.unique(secs // HOUR * HOUR))
+    return total
+
+
+def _get_partition_names(level: str, start: datetime.datetime, end: datetime.datetime):
+    if level == "hour":
+        return list(
+            map(
+                lambda x: x[: -len(observations.PARTITION_EXT)],
+                query.iter_partition_names(start, end),
+            )
+        )
+    first = start.astimezone(datetime.timezone.utc).year
+    last = end.astimezone(datetime.timezone.utc).year
+    return list(map(str, range(first, last + 1)))
+
+
+def read_rollup(
+    store_dir: str,
+    site_no: str,
+    level: str,
+    start: datetime.datetime,
+    end: datetime.datetime,
+):
+    """
+    Returns the `level` buckets of a site that start from `start` to
+    `end`, inclusive, reading only the partitions the range covers.
+    """
+    lower = np.datetime64(int(start.timestamp()), "s")
+    upper = np.datetime64(int(end.timestamp()), "s")
+    parts: list[Rollup] = []
+    for name in _get_partition_names(level, start, end):
+        path = _get_rollup_path(store_dir, site_no, level, name)
+        if not os.path.exists(path):
+            continue
+        rollup = _read_rollup_partition(path)
+        first = np.searchsorted(rollup["start"], lower, side="left")
+        last = np.searchsorted(rollup["start"], upper, side="right")
+        parts.append(_map_rollup(rollup, lambda x: x[first:last]))
+    if len(parts) == 0:
+        return _build_rollup(np.array([], np.int64), _empty_cols(0))
+    cols = dict(
+        map(lambda x: (x, np.concatenate(list(map(lambda y: y[x], parts)))), parts[0])
+    )
+    return cast(Rollup, cols)
+
+
+def pick_level(
+    start: datetime.datetime,
+    end: datetime.datetime,
+    max_points: int = MAX_CHART_POINTS,
+):
+    """
+    Returns the finest rollup level that covers the range in at most
+    `max_points` buckets, falling back to daily buckets.
+    """
+    span = (end - start).total_seconds()
+    for level, size in sorted(LEVELS.items(), key=lambda x: x[1]):
+        if span / size <= max_points:
+            return level
+    return "day"
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+from typing import TypedDict
+from decimal import Decimal
+import datetime
+import zoneinfo
+
+import numpy as np
+
+from riverdata.types import NormRow
+
+
+class RowBatch(TypedDict):
+    """
+    Columnar form of a site's normalized readings, newest first.
+
+    `datetime` holds UTC timestamps. Values are fixed point, as int64
+    hundredths. Missing values are stored as 0 and flagged False in the
+    matching `_valid` mask.
+    """
+
+    datetime: np.ndarray
+    discharge: np.ndarray
+    discharge_valid: np.ndarray
+    temperature: np.ndarray
+    temperature_valid: np.ndarray
+
+
+PARAMS = ("discharge", "temperature")
+
+UTC = zoneinfo.ZoneInfo("UTC")
+
+PLACES = 2
+
+SCALE = 10**PLACES
+
+QUANTUM = Decimal(1).scaleb(-PLACES)
+
+TIE_TOLERANCE = 1e-6
+
+
+def parse_fixed(val: str):
+    """
+    Parses a decimal string into integer hundredths. Strings with more
+    places are rounded half to even, like `Decimal.quantize`.
+    """
+    whole, _, frac = val.lstrip("+-").partition(".")
+    if len(frac) > PLACES or "e" in val or "E" in val:
+        return int(Decimal(val).quantize(QUANTUM).scaleb(PLACES))
+    ret = int(whole or "0") * SCALE + int(frac.ljust(PLACES, "0"))
+    return -ret if val.startswith("-") else ret
+
+
+def from_strs(strs: list[str]):
+    """
+    Parses a column of decimal strings, with "" for missing values, into
+    fixed point values and a valid mask.
+
+    The column is parsed and scaled in one NumPy pass, which is exact
+    for values on the fixed point grid. Values that land on a tie
+    between two hundredths are parsed again by `parse_fixed` so they
+    round half to even on their decimal digits, not on their binary
+    approximation.
+    """
+    arr = np.array(strs, dtype=str)
+    valid = arr != ""
+    scaled = arr[valid].astype(np.float64) * SCALE
+    fixed = np.rint(scaled)
+    vals = np.zeros(len(arr), np.int64)
+    vals[valid] = fixed
+    ties = np.abs(np.abs(scaled - fixed) - 0.5) < TIE_TOLERANCE
+    for idx in np.flatnonzero(valid)[ties]:
+        vals[idx] = parse_fixed(strs[idx])
+    return (vals, valid)
+
+
+def _build_vals(vals: list[Decimal | None]):
+    valid = np.fromiter(map(lambda x: x is not None, vals), bool, len(vals))
+    arr = np.fromiter(
+        map(lambda x: 0 if x is None else int(x.scaleb(PLACES)), vals),
+        np.int64,
+        len(vals),
+    )
+    return (arr, valid)
+
+
+def from_norm_rows(rows: list[NormRow]):
+    times = np.fromiter(
+        map(lambda x: int(x["datetime"].timestamp()), rows), np.int64, len(rows)
+    )
+    discharge, discharge_valid = _build_vals(list(map(lambda x: x["discharge"], rows)))
+    temperature, temperature_valid = _build_vals(
+        list(map(lambda x: x["temperature"], rows))
+    )
+    ret: RowBatch = {
+        "datetime": times.astype("datetime64[s]"),
+        "discharge": discharge,
+        "discharge_valid": discharge_valid,
+        "temperature": temperature,
+        "temperature_valid": temperature_valid,
+    }
+    return ret
+
+
+def get_size(batch: RowBatch):
+    return len(batch["datetime"])
+
+
+def to_datetime(val: np.datetime64):
+    secs = int(val.astype("datetime64[s]").astype(np.int64))
+    return datetime.datetime.fromtimestamp(secs, tz=UTC)
+
+
+def to_decimal(val: int):
+    """
+    Converts a fixed point value to a `Decimal` with two places.
+    """
+    return Decimal(int(val)).scaleb(-PLACES)
+
+
+def concat(batches: list[RowBatch]):
+    """
+    Joins batches into one, in the given order. Batches of consecutive
+    time spans must be passed newest first to keep the result newest
+    first.
+    """
+    if len(batches) == 0:
+        return from_norm_rows([])
+    ret: RowBatch = {
+        "datetime": np.concatenate(list(map(lambda x: x["datetime"], batches))).astype(
+            "datetime64[s]"
+        ),
+        "discharge": np.concatenate(list(map(lambda x: x["discharge"], batches))),
+        "discharge_valid": np.concatenate(
+            list(map(lambda x: x["discharge_valid"], batches))
+        ).astype(bool),
+        "temperature": np.concatenate(list(map(lambda x: x["temperature"], batches))),
+        "temperature_valid": np.concatenate(
+            list(map(lambda x: x["temperature_valid"], batches))
+        ).astype(bool),
+    }
+    return ret
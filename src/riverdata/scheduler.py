@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+"""
+Long-running polling of sites, each on its own schedule.
+
+Every site is polled again once its next reading is expected, based on
+the cadence its readings have been arriving at. Sites that return no
+new data or fail are backed off exponentially up to `MAX_INTERVAL`.
+Sites due at about the same time share one multi-site request.
+"""
+
+from typing import Callable, TypedDict
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import heapq
+import logging
+import random
+import threading
+import time
+
+import numpy as np
+import requests
+
+from riverdata import fetch, rowbatch, storage
+from riverdata.online import OnlinePredictor
+from riverdata.rowbatch import RowBatch
+from riverdata.sites import SITES
+from riverdata.types import Site, Stat, Stats
+
+DEFAULT_CADENCE = 15 * 60.0
+
+MIN_INTERVAL = 5 * 60.0
+
+MAX_INTERVAL = 6 * 60 * 60.0
+
+PUBLISH_DELAY = 2 * 60.0
+
+BACKOFF_FACTOR = 2.0
+
+CADENCE_READINGS = 8
+
+JITTER = 0.1
+
+BATCH_WINDOW = 60.0
+
+logger = logging.getLogger(__name__)
+
+
+class SiteState(TypedDict):
+    site_no: str
+    due: float
+    interval: float
+    cadence: float
+    newest: datetime.datetime | None
+    idle: int
+    failures: int
+
+
+def _get_newest(stat: Stat):
+    dts = filter(
+        lambda x: x is not None,
+        [stat["discharge_recent_datetime"], stat["temp_recent_datetime"]],
+    )
+    return max(dts, default=None)
+
+
+def _get_cadence(batch: RowBatch):
+    """
+    Returns the median gap in seconds between the last
+    `CADENCE_READINGS` readings of a batch, or None if it has fewer
+    than two. Gaps between readings do not depend on when the site was
+    polled, so backoff or a restart with old stats cannot skew them.
+    """
+    secs = batch["datetime"][: CADENCE_READINGS + 1].astype(np.int64)
+    gaps = secs[:-1] - secs[1:]
+    gaps = gaps[gaps > 0]
+    if len(gaps) == 0:
+        return None
+    return float(np.median(gaps))
+
+
+def _apply_predictions(stat: Stat, predictor: OnlinePredictor):
+    """
+    Returns a copy of `stat` with the predictions of `predictor` in
+    place of the batch fit's, for the parameters the stats report.
+    """
+    ret = stat.copy()
+    discharge = predictor.get_prediction(stat["site_no"], "discharge")
+    if discharge is not None and stat["discharge_recent_value"] is not None:
+        ret["discharge_prediction_value"] = rowbatch.to_decimal(discharge["values"][-1])
+        ret["discharge_prediction_direction"] = discharge["direction"]
+    temp = predictor.get_prediction(stat["site_no"], "temperature")
+    if temp is not None and stat["temp_recent_value"] is not None:
+        ret["temp_prediction_value"] = rowbatch.to_decimal(temp["values"][-1])
+        ret["temp_prediction_direction"] = temp["direction"]
+    return ret
+
+
+def _clamp(val: float, lower: float, upper: float):
+    return max(lower, min(upper, val))
+
+
+class Scheduler:
+    """
+    Polls sites on adaptive per-site intervals and keeps the latest
+    stats in memory.
+
+    Stats are written as they arrive: changed entries are appended to
+    the JSON stats document at `stats_filepath` through a
+    `storage.IncrementalWriter`, and the binary snapshot at
+    `snapshot_filepath` is rewritten. `predictor` is fed every new
+    reading fetched, and its predictions replace the batch fit's in the
+    stats, before `on_stats` is called with the entries fetched in
+    every round.
+    """
+
+    def __init__(
+        self,
+        sites: list[Site] = SITES,
+        stats_filepath: str | None = None,
+        snapshot_filepath: str | None = None,
+        store_dir: str | None = None,
+        concurrency: int = fetch.FETCH_CONCURRENCY,
+        batch_size: int = fetch.FETCH_BATCH_SIZE,
+        on_stats: Callable[[Stats], None] | None = None,
+        predictor: OnlinePredictor | None = None,
+        clock: Callable[[], float] = time.time,
+        seed: int | None = None,
+    ):
+        self.sites: dict[str, Site] = dict(map(lambda x: (x["site_no"], x), sites))
+        self.snapshot_filepath = snapshot_filepath
+        self.store_dir = store_dir
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.on_stats = on_stats
+        self.predictor = predictor
+        self.clock = clock
+        self._rnd = random.Random(seed)
+        self._stop = threading.Event()
+        self.writer = (
+            None
+            if stats_filepath is None
+            else storage.IncrementalWriter(stats_filepath)
+        )
+        self.stats: Stats = {} if self.writer is None else dict(self.writer.stats)
+        now = clock()
+        self.states: dict[str, SiteState] = {}
+        self._heap: list[tuple[float, str]] = []
+        for site_no in self.sites:
+            stat = self.stats.get(site_no)
+            self.states[site_no] = {
+                "site_no": site_no,
+                "due": now,
+                "interval": 0.0,
+                "cadence": DEFAULT_CADENCE,
+                "newest": None if stat is None else _get_newest(stat),
+                "idle": 0,
+                "failures": 0,
+            }
+            heapq.heappush(self._heap, (now, site_no))
+
+    def _jitter(self, interval: float):
+        return interval * self._rnd.uniform(1 - JITTER, 1 + JITTER)
+
+    def _schedule(self, state: SiteState, now: float, interval: float):
+        state["interval"] = interval
+        state["due"] = now + interval
+        heapq.heappush(self._heap, (state["due"], state["site_no"]))
+
+    def _on_new_data(
+        self,
+        state: SiteState,
+        now: float,
+        newest: datetime.datetime,
+        batch: RowBatch,
+    ):
+        cadence = _get_cadence(batch)
+        if cadence is not None:
+            state["cadence"] = _clamp(cadence, MIN_INTERVAL, MAX_INTERVAL)
+        state["newest"] = newest
+        state["idle"] = 0
+        state["failures"] = 0
+        expected = newest.timestamp() + state["cadence"] + PUBLISH_DELAY
+        interval = _clamp(expected - now, MIN_INTERVAL, MAX_INTERVAL)
+        self._schedule(state, now, self._jitter(interval))
+
+    def _on_no_data(self, state: SiteState, now: float):
+        state["idle"] += 1
+        state["failures"] = 0
+        interval = MIN_INTERVAL * BACKOFF_FACTOR ** state["idle"]
+        self._schedule(state, now, self._jitter(min(MAX_INTERVAL, interval)))
+
+    def _on_error(self, state: SiteState, now: float):
+        state["failures"] += 1
+        interval = MIN_INTERVAL * BACKOFF_FACTOR ** (state["failures"] - 1)
+        self._schedule(state, now, self._jitter(min(MAX_INTERVAL, interval)))
+
+    def _pop_due(self, now: float):
+        """
+        Removes and returns the sites due by `now`, along with sites due
+        within `BATCH_WINDOW` of it so they share requests.
+        """
+        ret: list[Site] = []
+        while len(self._heap) > 0 and self._heap[0][0] <= now + BATCH_WINDOW:
+            due, site_no = heapq.heappop(self._heap)
+            if site_no not in self.states or self.states[site_no]["due"] != due:
+                continue
+            ret.append(self.sites[site_no])
+        return ret
+
+    def _fetch_batch(self, batch: list[Site], session: requests.Session):
+        try:
+            return fetch.process_batch_rows(batch, session, self.store_dir)
+        except requests.RequestException as exc:
+            site_nos = ",".join(map(lambda x: x["site_no"], batch))
+            logger.warning("Fetch failed for sites %s: %s", site_nos, exc)
+        except Exception:
+            site_nos = ",".join(map(lambda x: x["site_no"], batch))
+            logger.exception("Processing failed for sites %s", site_nos)
+        return None
+
+    def _write(self, fetched: Stats):
+        if self.writer is not None:
+            self.writer.write(fetched)
+        if self.snapshot_filepath is not None:
+            storage.write_sites_snapshot(self.snapshot_filepath, self.stats)
+        if self.on_stats is not None:
+            self.on_stats(fetched)
+        return True
+
+    def poll_due(self, session: requests.Session | None = None):
+        """
+        Polls every site that is due, reschedules it, and writes the
+        fetched stats. Returns the fetched stats.
+        """
+        now = self.clock()
+        due = self._pop_due(now)
+        if len(due) == 0:
+            return {}
+        batches = fetch.chunk_sites(due, self.batch_size)
+        workers = max(1, min(self.concurrency, len(batches)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda b: self._fetch_batch(b, session), batches))
+        now = self.clock()
+        fetched: Stats = {}
+        for batch, batch_results in zip(batches, results):
+            for i, site in enumerate(batch):
+                state = self.states[site["site_no"]]
+                if batch_results is None:
+                    self._on_error(state, now)
+                    continue
+                result = batch_results[i]
+                stat = None if result is None else result["stat"]
+                if result is not None and self.predictor is not None:
+                    self.predictor.add_batch(site["site_no"], result["batch"])
+                    if stat is not None:
+                        stat = _apply_predictions(stat, self.predictor)
+                newest = None if stat is None else _get_newest(stat)
+                if stat is not None:
+                    self.stats[site["site_no"]] = stat
+                    fetched[site["site_no"]] = stat
+                if newest is None or (
+                    state["newest"] is not None and newest <= state["newest"]
+                ):
+                    self._on_no_data(state, now)
+                    continue
+                self._on_new_data(state, now, newest, result["batch"])
+        if len(fetched) > 0:
+            self._write(fetched)
+        return fetched
+
+    def get_next_due(self):
+        return None if len(self._heap) == 0 else self._heap[0][0]
+
+    def stop(self):
+        self._stop.set()
+        return True
+
+    def run(self, max_rounds: int | None = None):
+        """
+        Polls until `stop()` is called or `max_rounds` rounds have run,
+        sleeping until the next site is due in between.
+        """
+        rounds = 0
+        workers = max(1, min(self.concurrency, len(self.sites)))
+        with fetch.make_session(workers) as session:
+            while not self._stop.is_set():
+                self.poll_due(session)
+                rounds += 1
+                next_due = self.get_next_due()
+                if next_due is None:
+                    break
+                if max_rounds is not None and rounds >= max_rounds:
+                    break
+                self._stop.wait(max(0.0, next_due - self.clock()))
+        return rounds
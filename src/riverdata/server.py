@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+"""
+Local HTTP read service for a stats file or snapshot.
+
+The stats are decoded once and held in memory, and reloaded only when
+the file, or its incremental log, is replaced or appended to. Response
+bodies are serialized, and compressed when large enough, the first time
+they are asked for and then reused until the next reload, so a request
+costs a `stat` of the stats file and a socket write.
+
+Routes:
+
+- `GET /parks`, optionally `?region=<region>`
+- `GET /sites`
+- `GET /sites/<site_no>`
+"""
+
+from typing import TypedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from riverdata import metrics, storage
+from riverdata.jsonlib import NewJSONEncoder
+from riverdata.registry import Registry, get_registry
+from riverdata.snapshot import SnapshotReader, is_snapshot
+from riverdata.types import Stats
+
+DEFAULT_HOST = "127.0.0.1"
+
+DEFAULT_PORT = 8080
+
+GZIP_MIN_SIZE = 1024
+
+GZIP_LEVEL = 6
+
+CONTENT_TYPE = "application/json; charset=utf-8"
+
+logger = logging.getLogger(__name__)
+
+
+class Body(TypedDict):
+    data: bytes
+    gzip: bytes | None
+    etag: str
+    etag_gzip: str
+
+
+def _get_file_version(filepath: str):
+    try:
+        st = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _render(obj: object):
+    data = json.dumps(
+        obj, ensure_ascii=False, separators=(",", ":"), cls=NewJSONEncoder
+    ).encode("utf-8")
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    ret: Body = {
+        "data": data,
+        "gzip": (
+            gzip.compress(data, GZIP_LEVEL, mtime=0)
+            if len(data) >= GZIP_MIN_SIZE
+            else None
+        ),
+        "etag": '"%s"' % digest,
+        "etag_gzip": '"%s-gz"' % digest,
+    }
+    return ret
+
+
+def _read_stats(stats_filepath: str):
+    if not os.path.exists(stats_filepath):
+        ret: Stats = {}
+        return ret
+    if is_snapshot(stats_filepath):
+        with SnapshotReader(stats_filepath) as reader:
+            return reader.read_all()
+    return storage.read_sites(stats_filepath)
+
+
+class StatsView:
+    """
+    One loaded version of the stats, with its rendered bodies.
+
+    Bodies are keyed by route and built on first use. Two threads may
+    race to build the same body, which only costs the duplicate work.
+    Misses are not kept, so requests for unknown sites do not grow it.
+    """
+
+    def __init__(self, site_stats: Stats, registry: Registry):
+        self.site_stats = site_stats
+        self.registry = registry
+        self._bodies: dict[str, Body] = {}
+
+    def _build(self, key: str):
+        kind, _, arg = key.partition("/")
+        if kind == "parks":
+            if arg != "" and arg not in self.registry.get_regions():
+                return None
+            parks = (
+                self.registry.parks
+                if arg == ""
+                else self.registry.get_parks_in_region(arg)
+            )
+            return _render(storage.build_parks_stats(self.site_stats, parks))
+        if kind == "sites" and arg == "":
+            return _render(self.site_stats)
+        if kind == "site" and arg in self.site_stats:
+            return _render(self.site_stats[arg])
+        return None
+
+    def get_body(self, key: str):
+        """
+        Returns the body for a route key, `parks/<region>`, `sites/` or
+        `site/<site_no>`, or None if there is nothing at it.
+        """
+        ret = self._bodies.get(key)
+        if ret is None:
+            ret = self._build(key)
+            if ret is not None:
+                self._bodies[key] = ret
+        return ret
+
+
+class StatsCache:
+    """
+    Holds the current `StatsView` of the stats at `stats_filepath`.
+    """
+
+    def __init__(self, stats_filepath: str, registry: Registry | None = None):
+        self.stats_filepath = stats_filepath
+        self.registry = get_registry() if registry is None else registry
+        self._lock = threading.Lock()
+        self._version: object = None
+        self._view: StatsView | None = None
+
+    def _get_version(self):
+        return (
+            _get_file_version(self.stats_filepath),
+            _get_file_version(storage.get_log_filepath(self.stats_filepath)),
+        )
+
+    def _load(self, version: object):
+        with metrics.timed("reload") as timer:
+            try:
+                site_stats = _read_stats(self.stats_filepath)
+            except (OSError, ValueError) as exc:
+                if self._view is None:
+                    raise
+                logger.warning(
+                    "Keeping previous stats, reading %s failed: %s",
+                    self.stats_filepath,
+                    exc,
+                )
+                return self._view
+            timer.rows = len(site_stats)
+        self._view = StatsView(site_stats, self.registry)
+        self._version = version
+        return self._view
+
+    def get_view(self):
+        """
+        Returns the view of the stats as they are on disk now, loading
+        them again if either file has changed since the last call.
+        """
+        version = self._get_version()
+        view = self._view
+        if view is not None and version == self._version:
+            return view
+        with self._lock:
+            if self._view is not None and version == self._version:
+                return self._view
+            return self._load(version)
+
+
+def _get_route_key(path: str, query: dict[str, list[str]]):
+    parts = list(filter(None, path.split("/")))
+    if parts == ["parks"]:
+        return "parks/" + (query["region"][0] if "region" in query else "")
+    if parts == ["sites"]:
+        return "sites/"
+    if len(parts) == 2 and parts[0] == "sites":
+        return "site/" + parts[1]
+    return None
+
+
+def _accepts_gzip(header: str | None):
+    if header is None:
+        return False
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip().lower() not in ("gzip", "*"):
+            continue
+        qval = params.strip()
+        return not (qval.startswith("q=") and qval[2:].strip("0.") == "")
+    return False
+
+
+def _matches_etag(header: str | None, etags: tuple[str, ...]):
+    if header is None:
+        return False
+    tags = list(map(lambda x: x.strip().removeprefix("W/"), header.split(",")))
+    return "*" in tags or any(map(lambda x: x in tags, etags))
+
+
+class StatsRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    disable_nagle_algorithm = True
+
+    server: "StatsServer"
+
+    def log_message(self, format: str, *args: object):
+        logger.debug(format, *args)
+
+    def _send(self, status: int, body: bytes, headers: dict[str, str], head: bool):
+        self.send_response(status)
+        for name, val in headers.items():
+            self.send_header(name, val)
+        if status != 304:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+        return True
+
+    def _handle(self, head: bool):
+        url = urlsplit(self.path)
+        key = _get_route_key(url.path, parse_qs(url.query))
+        body = None if key is None else self.server.stats.get_view().get_body(key)
+        if body is None:
+            return self._send(
+                404,
+                b'{"error":"not found"}',
+                {"Content-Type": CONTENT_TYPE},
+                head,
+            )
+        use_gzip = body["gzip"] is not None and _accepts_gzip(
+            self.headers.get("Accept-Encoding")
+        )
+        headers = {
+            "Content-Type": CONTENT_TYPE,
+            "Cache-Control": "no-cache",
+            "ETag": body["etag_gzip"] if use_gzip else body["etag"],
+            "Vary": "Accept-Encoding",
+        }
+        if _matches_etag(
+            self.headers.get("If-None-Match"), (body["etag"], body["etag_gzip"])
+        ):
+            return self._send(304, b"", headers, True)
+        if use_gzip:
+            headers["Content-Encoding"] = "gzip"
+            return self._send(200, body["gzip"] or b"", headers, head)
+        return self._send(200, body["data"], headers, head)
+
+    def do_GET(self):
+        self._handle(False)
+
+    def do_HEAD(self):
+        self._handle(True)
+
+
+class StatsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], stats: StatsCache):
+        self.stats = stats
+        super().__init__(address, StatsRequestHandler)
+
+
+def make_server(
+    stats_filepath: str,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    registry: Registry | None = None,
+):
+    """
+    Returns a server for the stats at `stats_filepath`, with the stats
+    already loaded. Call `serve_forever` on it to start serving.
+    """
+    stats = StatsCache(stats_filepath, registry)
+    stats.get_view()
+    return StatsServer((host, port), stats)
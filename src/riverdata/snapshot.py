@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+"""
+Compact binary stats snapshot, readable through `mmap`.
+
+Layout, all little-endian:
+
+- Header: magic, record count, index slot count.
+- Index: an open-addressing hash table of `(site_no, offset, length)`
+  slots keyed on the CRC32 of the site number, so a reader finds one
+  site's record in O(1) without decoding anything else.
+- Records: a fixed-layout block of numeric fields followed by the
+  length-prefixed UTF-8 string fields.
+
+Decimals are stored as integer hundredths and datetimes as UTC
+microseconds since the epoch. Missing values use a per-type sentinel.
+"""
+
+from typing import Iterator, cast
+from decimal import Decimal
+import datetime
+import mmap
+import struct
+import zlib
+
+from riverdata.fileio import atomic_open
+from riverdata.types import Stat, Stats
+
+MAGIC = b"RVDSNP01"
+
+HEADER = struct.Struct("<8sII")
+
+SLOT = struct.Struct("<16sQI")
+
+STR_LEN = struct.Struct("<H")
+
+SITE_NO_SIZE = 16
+
+DECIMAL_PLACES = 2
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+STR_FIELDS = (
+    "site_no",
+    "site_name_short",
+    "site_name_full",
+    "site_region",
+    "site_timezone",
+    "data_url",
+)
+
+NUM_FIELDS: list[tuple[str, str]] = [
+    ("rowcount", "int"),
+    ("fetch_datetime", "datetime"),
+    ("begin_date", "date"),
+    ("discharge_recent_value", "decimal"),
+    ("discharge_recent_datetime", "datetime"),
+    ("discharge_prediction_value", "decimal"),
+    ("discharge_prediction_direction", "direction"),
+    ("discharge_high_value", "decimal"),
+    ("discharge_low_value", "decimal"),
+    ("discharge_high_datetime", "datetime"),
+    ("discharge_low_datetime", "datetime"),
+    ("temp_recent_value", "decimal"),
+    ("temp_recent_datetime", "datetime"),
+    ("temp_prediction_value", "decimal"),
+    ("temp_prediction_direction", "direction"),
+    ("temp_high_value", "decimal"),
+    ("temp_low_value", "decimal"),
+    ("temp_high_datetime", "datetime"),
+    ("temp_low_datetime", "datetime"),
+]
+
+TYPE_CODES = {
+    "int": "q",
+    "datetime": "q",
+    "date": "i",
+    "decimal": "q",
+    "direction": "b",
+}
+
+TYPE_NULLS = {
+    "int": -(2**63),
+    "datetime": -(2**63),
+    "date": -(2**31),
+    "decimal": -(2**63),
+    "direction": -128,
+}
+
+RECORD = struct.Struct("<" + "".join(map(lambda x: TYPE_CODES[x[1]], NUM_FIELDS)))
+
+
+def _encode_decimal(val: Decimal):
+    scaled = val.scaleb(DECIMAL_PLACES)
+    if scaled != scaled.to_integral_value():
+        raise ValueError(
+            "Decimal %s has more than %d places" % (str(val), DECIMAL_PLACES)
+        )
+    return int(scaled)
+
+
+def _encode_datetime(val: datetime.datetime):
+    delta = val - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _encode_num(val: object, dtype: str):
+    if val is None:
+        return TYPE_NULLS[dtype]
+    if dtype == "decimal":
+        return _encode_decimal(cast(Decimal, val))
+    if dtype == "datetime":
+        return _encode_datetime(cast(datetime.datetime, val))
+    if dtype == "date":
+        return cast(datetime.date, val).toordinal()
+    return int(cast(int, val))
+
+
+def _decode_num(val: int, dtype: str):
+    if val == TYPE_NULLS[dtype]:
+        return None
+    if dtype == "decimal":
+        return Decimal(val).scaleb(-DECIMAL_PLACES)
+    if dtype == "datetime":
+        return EPOCH + datetime.timedelta(microseconds=val)
+    if dtype == "date":
+        return datetime.date.fromordinal(val)
+    return val
+
+
+def _encode_record(stat: Stat):
+    nums = map(lambda x: _encode_num(stat.get(x[0]), x[1]), NUM_FIELDS)
+    parts = [RECORD.pack(*nums)]
+    for name in STR_FIELDS:
+        raw = cast(str, stat.get(name, "")).encode("utf-8")
+        parts.append(STR_LEN.pack(len(raw)))
+        parts.append(raw)
+    return b"".join(parts)
+
+
+def _decode_record(buf: mmap.mmap | bytes, offset: int):
+    """
+    Decodes the record at `offset`. Returns the stat and the offset just
+    past the record.
+    """
+    nums = RECORD.unpack_from(buf, offset)
+    pos = offset + RECORD.size
+    ret: dict[str, object] = {}
+    for name in STR_FIELDS:
+        (size,) = STR_LEN.unpack_from(buf, pos)
+        pos += STR_LEN.size
+        ret[name] = bytes(buf[pos : pos + size]).decode("utf-8")
+        pos += size
+    for (name, dtype), val in zip(NUM_FIELDS, nums):
+        ret[name] = _decode_num(val, dtype)
+    return (cast(Stat, ret), pos)
+
+
+def _encode_site_no(site_no: str):
+    raw = site_no.encode("utf-8")
+    if len(raw) > SITE_NO_SIZE:
+        raise ValueError("Site number too long for snapshot: %s" % site_no)
+    return raw
+
+
+def _get_slot_count(count: int):
+    slots = 1
+    while slots < count * 2:
+        slots *= 2
+    return slots
+
+
+def _build_index(keys: list[bytes], offsets: list[tuple[int, int]], slots: int):
+    table: list[tuple[bytes, int, int] | None] = [None] * slots
+    for key, (offset, length) in zip(keys, offsets):
+        pos = zlib.crc32(key) & (slots - 1)
+        while table[pos] is not None:
+            pos = (pos + 1) & (slots - 1)
+        table[pos] = (key, offset, length)
+    empty = (b"", 0, 0)
+    return b"".join(map(lambda x: SLOT.pack(*(empty if x is None else x)), table))
+
+
+def write_snapshot(snapshot_filepath: str, stats: Stats):
+    """
+    Writes stats as a binary snapshot.
+
+    The file is written to a temporary file and renamed into place, so
+    readers that have the previous snapshot mapped keep a consistent
+    view of it.
+    """
+    keys = list(map(_encode_site_no, stats.keys()))
+    records = list(map(_encode_record, stats.values()))
+    slots = _get_slot_count(len(records))
+    pos = HEADER.size + slots * SLOT.size
+    offsets: list[tuple[int, int]] = []
+    for record in records:
+        offsets.append((pos, len(record)))
+        pos += len(record)
+    with atomic_open(snapshot_filepath, "wb") as fh:
+        fh.write(HEADER.pack(MAGIC, len(records), slots))
+        fh.write(_build_index(keys, offsets, slots))
+        for record in records:
+            fh.write(record)
+    return True
+
+
+def is_snapshot(filepath: str):
+    with open(filepath, "rb") as fh:
+        return fh.read(len(MAGIC)) == MAGIC
+
+
+class SnapshotReader:
+    """
+    Memory-maps a snapshot and decodes single records on demand.
+    """
+
+    def __init__(self, snapshot_filepath: str):
+        with open(snapshot_filepath, "rb") as fh:
+            self._buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self._slots = HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC:
+            self._buf.close()
+            raise ValueError("Not a stats snapshot: %s" % snapshot_filepath)
+        self._data_offset = HEADER.size + self._slots * SLOT.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._buf.close()
+
+    def _find(self, site_no: str):
+        key = site_no.encode("utf-8")
+        if len(key) > SITE_NO_SIZE:
+            return None
+        pos = zlib.crc32(key) & (self._slots - 1)
+        for _ in range(self._slots):
+            slot_key, offset, length = SLOT.unpack_from(
+                self._buf, HEADER.size + pos * SLOT.size
+            )
+            if length == 0:
+                return None
+            if slot_key.rstrip(b"\0") == key:
+                return offset
+            pos = (pos + 1) & (self._slots - 1)
+        return None
+
+    def get(self, site_no: str):
+        offset = self._find(site_no)
+        if offset is None:
+            return None
+        stat, _ = _decode_record(self._buf, offset)
+        return stat
+
+    def __contains__(self, site_no: str):
+        return self._find(site_no) is not None
+
+    def __iter__(self) -> Iterator[Stat]:
+        pos = self._data_offset
+        for _ in range(self.count):
+            stat, pos = _decode_record(self._buf, pos)
+            yield stat
+
+    def read_all(self):
+        ret: Stats = dict(map(lambda x: (x["site_no"], x), self))
+        return ret
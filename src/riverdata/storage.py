@@ -1,59 +1,261 @@
 #!/usr/bin/env python3
 
 import json
+import os
 
-from riverdata.jsonlib import NewJSONEncoder, NewJsonDecoder
-from riverdata.sites import PARKS
+from riverdata.fileio import atomic_open
+from riverdata.jsonlib import NewJSONEncoder, TypedJsonDecoder
+from riverdata.snapshot import SnapshotReader, is_snapshot, write_snapshot
+from riverdata.registry import Registry, get_registry, get_park_site_nos
 from riverdata.types import ParkStat, Stats, ParkStats, Park
 
+LOG_SUFFIX = ".log"
+
+COMPACT_MIN_ENTRIES = 64
+
+COMPACT_RATIO = 1.0
+
+TRIM_CHUNK = 64 * 1024
+
+
+def get_log_filepath(river_data_filepath: str):
+    return river_data_filepath + LOG_SUFFIX
+
 
 def write_sites(river_data_filepath: str, stats: Stats):
-    with open(river_data_filepath, "w", encoding="utf-8") as fh:
+    """
+    Writes the full stats document. The file is replaced atomically, so
+    readers never observe a truncated document, and any incremental log
+    next to it is dropped since the document now supersedes it.
+    """
+    with atomic_open(river_data_filepath, "w", encoding="utf-8") as fh:
         json.dump(stats, fh, ensure_ascii=False, indent=2, cls=NewJSONEncoder)
+    log_filepath = get_log_filepath(river_data_filepath)
+    if os.path.exists(log_filepath):
+        os.unlink(log_filepath)
     return True
 
 
-def read_parks_stats(river_data_filepath: str):
-    def _build_park(park: Park, site_stats1: Stats):
-        stat_discharge = (
-            site_stats1[park["site_no_discharge"]]
-            if (park["site_no_discharge"] in site_stats1)
-            else None
-        )
-        stat_temperature = (
-            site_stats1[park["site_no_temperature"]]
-            if (park["site_no_temperature"] in site_stats1)
-            else None
-        )
-        ret: ParkStat = {
-            "park_name": park["name"],
-            "park_region": park["region"],
-            "park_timezone": park["timezone"],
-            "discharge_recent_value": (
-                None
-                if (stat_discharge is None)
-                else stat_discharge["discharge_recent_value"]
-            ),
-            "discharge_recent_datetime": (
-                None
-                if (stat_discharge is None)
-                else stat_discharge["discharge_recent_datetime"]
-            ),
-            "discharge_prediction_value": (
-                None
-                if (stat_discharge is None)
-                else stat_discharge["discharge_prediction_value"]
-            ),
-            "temp_recent_value": (
-                None
-                if (stat_temperature is None)
-                else stat_temperature["temp_recent_value"]
-            ),
-        }
-        return ret
+def _read_log(log_filepath: str, site_stats: Stats):
+    """
+    Applies log entries on top of `site_stats`, in order. Returns the
+    number of entries applied. A last line without a newline is an
+    append still in progress and is ignored.
+    """
+    if not os.path.exists(log_filepath):
+        return 0
+    decoder = TypedJsonDecoder()
+    count = 0
+    with open(log_filepath, "r", encoding="utf-8") as fh:
+        for line in fh:
+            if not line.endswith("\n"):
+                break
+            stat = decoder.decode(line)
+            site_stats[stat["site_no"]] = stat
+            count += 1
+    return count
+
+
+def trim_log(log_filepath: str):
+    """
+    Cuts a partial last line, left by an interrupted append, off the end
+    of the log so the next append starts on a line of its own. Returns
+    True if anything was cut.
+    """
+    if not os.path.exists(log_filepath):
+        return False
+    with open(log_filepath, "r+b") as fh:
+        end = fh.seek(0, os.SEEK_END)
+        keep = 0
+        pos = end
+        while pos > 0:
+            start = max(0, pos - TRIM_CHUNK)
+            fh.seek(start)
+            idx = fh.read(pos - start).rfind(b"\n")
+            if idx >= 0:
+                keep = start + idx + 1
+                break
+            pos = start
+        if keep == end:
+            return False
+        fh.truncate(keep)
+        fh.flush()
+        os.fsync(fh.fileno())
+    return True
+
+
+def _read_sites_counted(river_data_filepath: str):
+    site_stats: Stats = {}
+    if os.path.exists(river_data_filepath):
+        with open(river_data_filepath, "r", encoding="utf-8") as fh:
+            site_stats = json.load(fh, cls=TypedJsonDecoder)
+    count = _read_log(get_log_filepath(river_data_filepath), site_stats)
+    return (site_stats, count)
+
+
+def read_sites(river_data_filepath: str):
+    """
+    Reads the full stats document, including entries appended to its
+    incremental log since it was last compacted.
+    """
+    site_stats, _ = _read_sites_counted(river_data_filepath)
+    return site_stats
+
+
+class IncrementalWriter:
+    """
+    Keeps a stats document current by appending only changed entries.
+
+    Entries whose content differs from what is stored, such as a new
+    `fetch_datetime` or new values, are appended as JSON lines to a log
+    next to the document. Once the log holds more than `compact_ratio`
+    times as many entries as there are sites (and at least
+    `compact_min` entries), it is folded back into the document with an
+    atomic rewrite. Expects to be the only writer of the document, and
+    trims a partial entry left by an interrupted writer when opened.
+    """
+
+    def __init__(
+        self,
+        river_data_filepath: str,
+        compact_min: int = COMPACT_MIN_ENTRIES,
+        compact_ratio: float = COMPACT_RATIO,
+    ):
+        self.filepath = river_data_filepath
+        self.log_filepath = get_log_filepath(river_data_filepath)
+        self.compact_min = compact_min
+        self.compact_ratio = compact_ratio
+        trim_log(self.log_filepath)
+        self.stats, self.log_count = _read_sites_counted(river_data_filepath)
+
+    def _needs_compact(self):
+        if not os.path.exists(self.filepath):
+            return True
+        if self.log_count < self.compact_min:
+            return False
+        return self.log_count > self.compact_ratio * len(self.stats)
+
+    def compact(self):
+        write_sites(self.filepath, self.stats)
+        self.log_count = 0
+        return True
+
+    def write(self, stats: Stats):
+        """
+        Records the given entries, which may cover only some sites.
+        Returns the site numbers that changed.
+        """
+        changed = list(filter(lambda x: self.stats.get(x) != stats[x], stats.keys()))
+        if len(changed) == 0:
+            return changed
+        for site_no in changed:
+            self.stats[site_no] = stats[site_no]
+        self.log_count += len(changed)
+        if self._needs_compact():
+            self.compact()
+            return changed
+        with open(self.log_filepath, "a", encoding="utf-8") as fh:
+            for site_no in changed:
+                fh.write(
+                    json.dumps(stats[site_no], ensure_ascii=False, cls=NewJSONEncoder)
+                )
+                fh.write("\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+        return changed
+
+
+def write_sites_incremental(river_data_filepath: str, stats: Stats):
+    return IncrementalWriter(river_data_filepath).write(stats)
+
+
+def write_sites_snapshot(river_data_filepath: str, stats: Stats):
+    return write_snapshot(river_data_filepath, stats)
+
+
+def _read_snapshot_stats(river_data_filepath: str, site_nos: set[str]):
+    ret: Stats = {}
+    with SnapshotReader(river_data_filepath) as reader:
+        for site_no in site_nos:
+            stat = reader.get(site_no)
+            if stat is not None:
+                ret[site_no] = stat
+    return ret
+
+
+def read_site_stat(river_data_filepath: str, site_no: str):
+    """
+    Reads one site's stat from either a JSON stats file or a binary
+    snapshot. Snapshots are looked up without decoding other sites.
+    """
+    if is_snapshot(river_data_filepath):
+        with SnapshotReader(river_data_filepath) as reader:
+            return reader.get(site_no)
+    site_stats = read_sites(river_data_filepath)
+    return site_stats[site_no] if site_no in site_stats else None
+
+
+def _build_park_stat(park: Park, site_stats: Stats):
+    stat_discharge = (
+        site_stats[park["site_no_discharge"]]
+        if (park["site_no_discharge"] in site_stats)
+        else None
+    )
+    stat_temperature = (
+        site_stats[park["site_no_temperature"]]
+        if (park["site_no_temperature"] in site_stats)
+        else None
+    )
+    ret: ParkStat = {
+        "park_name": park["name"],
+        "park_region": park["region"],
+        "park_timezone": park["timezone"],
+        "discharge_recent_value": (
+            None
+            if (stat_discharge is None)
+            else stat_discharge["discharge_recent_value"]
+        ),
+        "discharge_recent_datetime": (
+            None
+            if (stat_discharge is None)
+            else stat_discharge["discharge_recent_datetime"]
+        ),
+        "discharge_prediction_value": (
+            None
+            if (stat_discharge is None)
+            else stat_discharge["discharge_prediction_value"]
+        ),
+        "temp_recent_value": (
+            None
+            if (stat_temperature is None)
+            else stat_temperature["temp_recent_value"]
+        ),
+    }
+    return ret
+
+
+def build_parks_stats(site_stats: Stats, parks: list[Park]):
+    """
+    Builds stats for `parks` from already loaded site stats.
+    """
+    ret: ParkStats = list(map(lambda p: _build_park_stat(p, site_stats), parks))
+    return ret
+
 
+def read_parks_stats(
+    river_data_filepath: str,
+    region: str | None = None,
+    registry: Registry | None = None,
+):
+    """
+    Builds stats for every park, or only for the parks in `region`.
+    """
+    registry = get_registry() if registry is None else registry
+    parks = registry.parks if region is None else registry.get_parks_in_region(region)
     site_stats: Stats
-    with open(river_data_filepath, "r", encoding="utf-8") as fh:
-        site_stats = json.load(fh, cls=NewJsonDecoder)
-    parks: ParkStats = list(map(lambda p: _build_park(p, site_stats), PARKS))
-    return parks
+    if is_snapshot(river_data_filepath):
+        site_nos = get_park_site_nos(parks)
+        site_stats = _read_snapshot_stats(river_data_filepath, site_nos)
+    else:
+        site_stats = read_sites(river_data_filepath)
+    return build_parks_stats(site_stats, parks)
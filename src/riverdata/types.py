@@ -28,6 +28,7 @@ class Stat(TypedDict):
     site_name_short: str
     site_name_full: str
     site_region: str
+    site_timezone: str
     data_url: str
     rowcount: int
     fetch_datetime: datetime.datetime
@@ -60,5 +61,25 @@ class Site(TypedDict):
     feature_temperature: bool
 
 
+class NormRowBase(TypedDict):
+    site_no: str
+    agency: str
+    datetime: datetime.datetime
+    timezone: str
+
+
+class NormRowDischarge(NormRowBase):
+    discharge: Decimal | None
+
+
+class NormRowTemperature(NormRowBase):
+    temperature: Decimal | None
+
+
+class NormRow(NormRowDischarge, NormRowTemperature):
+    discharge: Decimal | None
+    temperature: Decimal | None
+
+
 Stats = dict[str, Stat]
 ParkStats = list[ParkStat]
@@ -0,0 +1,39 @@
+import datetime
+import os
+
+from riverdata import backfill
+
+
+def _run_task(self, task, session):
+    self._record(task)
+    return 0
+
+
+def _run(checkpoint_filepath: str, site_nos: list[str]):
+    return backfill.backfill(
+        os.path.dirname(checkpoint_filepath),
+        datetime.date(2026, 1, 1),
+        datetime.date(2026, 1, 31),
+        sites=list(map(lambda x: {"site_no": x, "region": "CO"}, site_nos)),
+        batch_size=1,
+        checkpoint_filepath=checkpoint_filepath,
+    )
+
+
+def test_resume_after_interrupted_record(tmp_path, monkeypatch):
+    monkeypatch.setattr(backfill._Backfill, "run_task", _run_task)
+    filepath = str(tmp_path / "backfill.log")
+    assert _run(filepath, ["1"])["tasks"] == 1
+    with open(filepath, "a", encoding="utf-8") as fh:
+        fh.write('{"site_nos": ["2"], "begin_')
+
+    result = _run(filepath, ["1", "2"])
+    assert (result["tasks"], result["skipped"]) == (1, 1)
+
+    result = _run(filepath, ["1", "2", "3"])
+    assert (result["tasks"], result["skipped"]) == (1, 2)
+    assert backfill._read_checkpoint(filepath) == {
+        "1/2026-01-01",
+        "2/2026-01-01",
+        "3/2026-01-01",
+    }
@@ -0,0 +1,60 @@
+import datetime
+
+import numpy as np
+
+from riverdata import fetch
+
+SITE_TZ = "America/Denver"
+
+
+def _local_strs(first: datetime.datetime, days: int):
+    steps = days * 24 * 4
+    return list(
+        map(
+            lambda x: (first + datetime.timedelta(minutes=15 * x)).strftime(
+                "%Y-%m-%d %H:%M"
+            ),
+            range(steps),
+        )
+    )
+
+
+def _expected(dtstrs: list[str], tzstrs: list[str]):
+    return np.array(
+        list(
+            map(
+                lambda x: int(fetch._make_date(x[0], x[1], SITE_TZ).timestamp()),
+                zip(dtstrs, tzstrs),
+            )
+        ),
+        dtype=np.int64,
+    ).astype("datetime64[s]")
+
+
+def _check(dtstrs: list[str]):
+    codes = ["MDT", "MST", "EDT", "XYZ"]
+    tzstrs = list(map(lambda x: codes[x % len(codes)], range(len(dtstrs))))
+    got = fetch._make_dates(dtstrs, tzstrs, SITE_TZ)
+    np.testing.assert_array_equal(got, _expected(dtstrs, tzstrs))
+
+
+def test_make_dates_spring_forward():
+    # 2026-03-08 02:00 to 02:45 do not exist in America/Denver.
+    _check(_local_strs(datetime.datetime(2026, 3, 7), 3))
+
+
+def test_make_dates_fall_back():
+    # 2026-11-01 01:00 to 01:45 happen twice in America/Denver.
+    _check(_local_strs(datetime.datetime(2026, 10, 31), 3))
+
+
+def test_make_dates_per_row_fallback():
+    # NumPy does not parse the basic ISO format, so every row goes
+    # through _make_date.
+    dtstrs = list(
+        map(
+            lambda x: x.replace("-", "").replace(":", "").replace(" ", "T"),
+            _local_strs(datetime.datetime(2026, 11, 1), 1),
+        )
+    )
+    _check(dtstrs)
@@ -0,0 +1,22 @@
+import random
+
+from riverdata import math
+
+
+def test_batched_predictions_match_single():
+    rnd = random.Random(0)
+    seqs = [[10, 10, 15, 10, 10, 15, 10, 5]]
+    for _ in range(200):
+        size = rnd.choice([1, 3, 8])
+        seqs.append(list(map(lambda x: rnd.randint(-1000, 100000), range(size))))
+
+    predicted = math.get_prediction_infos_fixed(seqs, math.PREDICTION_COUNT)
+
+    for seq, prediction in zip(seqs, predicted):
+        assert prediction == math.get_prediction_info_fixed(seq, math.PREDICTION_COUNT)
+
+
+def test_batched_predictions_of_empty_sequence():
+    predicted = math.get_prediction_infos_fixed([[], [5]], math.PREDICTION_COUNT)
+    assert predicted[0] == {"values": [], "direction": 0}
+    assert predicted[1]["values"][-1] == 5
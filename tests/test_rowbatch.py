@@ -0,0 +1,20 @@
+from decimal import Decimal
+
+import numpy as np
+
+from riverdata import rowbatch
+
+
+def _quantize(val: str):
+    return int(Decimal(val).quantize(rowbatch.QUANTUM).scaleb(rowbatch.PLACES))
+
+
+def test_from_strs_rounds_ties_like_decimal():
+    strs = list(map(lambda x: "%d.%02d5" % divmod(x, 100), range(0, 200000, 7)))
+    strs += ["-0.125", "-2.675", "1.005", "0.015", "1e-3", "12", "-3.5", "", "4.10"]
+
+    vals, valid = rowbatch.from_strs(strs)
+
+    expected = list(map(lambda x: 0 if x == "" else _quantize(x), strs))
+    np.testing.assert_array_equal(vals, np.array(expected, dtype=np.int64))
+    np.testing.assert_array_equal(valid, np.array(list(map(bool, strs))))
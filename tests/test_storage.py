@@ -0,0 +1,21 @@
+from riverdata import storage
+
+
+def _stat(site_no: str, rowcount: int):
+    return {"site_no": site_no, "rowcount": rowcount}
+
+
+def test_incremental_write_after_interrupted_append(tmp_path):
+    filepath = str(tmp_path / "stats.json")
+    writer = storage.IncrementalWriter(filepath)
+    writer.write({"1": _stat("1", 1), "2": _stat("2", 1)})
+    writer.write({"1": _stat("1", 2)})
+    with open(filepath + storage.LOG_SUFFIX, "a", encoding="utf-8") as fh:
+        fh.write('{"site_no": "2", "rowc')
+    assert storage.read_sites(filepath)["1"]["rowcount"] == 2
+
+    storage.IncrementalWriter(filepath).write({"2": _stat("2", 3)})
+
+    site_stats = storage.read_sites(filepath)
+    assert site_stats["1"]["rowcount"] == 2
+    assert site_stats["2"]["rowcount"] == 3